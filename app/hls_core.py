@@ -0,0 +1 @@
+../piscripts/hls_core.py
\ No newline at end of file
@@ -0,0 +1,2254 @@
+# HLS player server shared by server5.py, server3.py and app/server3.py (app/hls_core.py links here).
+# Each server imports this, sets its port and whatever it does differently, then calls serve().
+import os
+import re
+import json
+import shutil
+import time
+import threading
+import urllib.parse
+import subprocess
+import queue
+import itertools
+import ipaddress
+import signal
+import fcntl
+import hashlib
+import bisect
+import math
+import secrets
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+from collections import defaultdict, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import mimetypes
+import requests
+
+APP_ROOT = os.getcwd()
+MEDIA_DIR = os.path.join(APP_ROOT, "media")
+# One content-addressed store for every HLS server on the box; each asset is packaged once
+HLS_STORE_DIR = os.path.join(APP_ROOT, "hls_store")
+HLS_LOCK_DIR = os.path.join(HLS_STORE_DIR, ".locks")
+HLS_CATALOGUE_FILE = os.path.join(HLS_STORE_DIR, "catalogue.json")
+LEGACY_HLS_DIRS = ("tmp_hls", "tmp_hls5")  # per-server output from before the shared store
+HLS_HISTORY_FILE = os.path.join(APP_ROOT, "watch_history.json")
+CACHE_FILE = os.path.join(APP_ROOT, "metadata_cache.json")
+PROBE_INDEX_FILE = os.path.join(APP_ROOT, "probe_index.json")
+
+OMDB_API_KEY = "98eb08a4"
+VIDEO_EXTENSIONS = (".mp4", ".mkv", ".avi", ".m4v")
+SKIP_TV_FOLDERS = False  # leave TV/ to TV.py
+FAVICON_URL = None
+
+movie_metadata = defaultdict(dict)
+metadata_cache = {}
+hls_last_access = {}
+hls_jobs = {}
+hls_foreign_jobs = set()  # assets another server is packaging that a request here is waiting on
+hls_flights = {}
+hls_flights_lock = threading.Lock()
+HLS_EXPIRATION_SECONDS = 30000
+HLS_SEGMENT_SECONDS = 10
+HLS_FAST_START_TIMES = (2, 4, 6, 10)
+HLS_MAX_SCHEDULE_SECONDS = 6 * 3600
+HLS_FIRST_SEGMENT_TIMEOUT = 30
+HLS_CACHE_MAX_BYTES = 16 * 1024 ** 3
+HLS_SESSION_TIMEOUT = 90  # players send a heartbeat every 30 seconds while loaded, even when paused
+hls_sessions = {}
+hls_sizes = {}
+hls_errors = {}
+# Bumped on every readiness change so clients can ask for just what changed since their last look.
+# Versions only mean something within one run, so they go out with HLS_RUN_ID and a client that comes
+# back with another run's ID gets everything.
+HLS_RUN_ID = secrets.token_hex(8)
+hls_state_version = 0
+hls_state_changes = {}
+hls_state_lock = threading.Lock()
+HLS_STATUS_BATCH_LIMIT = 2000
+
+# Server-sent events: one producer pushes readiness, job progress and library changes to every page
+EVENT_KEEPALIVE_SECONDS = 15
+LIBRARY_SCAN_SECONDS = 120
+event_clients = []
+event_clients_lock = threading.Lock()
+hls_changed = threading.Event()
+# What hls.js/MSE can play as-is; anything else is transcoded during packaging
+BROWSER_VIDEO_CODECS = ("h264",)
+BROWSER_AUDIO_CODECS = ("aac", "mp3")
+hls_cache_lock = threading.Lock()
+hls_sources = {}
+# Asset IDs hash the size, mtime and a few sampled blocks, so renames and moves keep their HLS output
+ASSET_SAMPLE_BYTES = 64 * 1024
+asset_ids = {}
+
+# "remux" writes a full TS copy to hls_store; "virtual" cuts segments from the source on request
+HLS_MODE = "remux"
+# Remux output: "mpegts" segment files, or "fmp4" for one fragmented MP4 per asset behind byte ranges
+HLS_SEGMENT_TYPE = "mpegts"
+HLS_FMP4_SEGMENT_SECONDS = 4
+VHLS_LOOKAHEAD = 2
+VHLS_CACHE_SEGMENTS = 8
+# Keyframe times are indexed in whole ms, rounded down, so a cut seeks this far past one to land on it
+# rather than on the keyframe before it
+VHLS_SEEK_SLACK = 0.001
+keyframe_index = {}
+vhls_sources = {}
+vhls_cache = OrderedDict()
+vhls_pending = {}
+vhls_lock = threading.Lock()
+
+# Tiered storage: new and active assets are written to tmpfs and moved to the disk store once they cool.
+# The store path never changes; a hot asset is a symlink from HLS_STORE_DIR into HLS_HOT_DIR.
+HLS_HOT_TIER = os.path.isdir("/dev/shm")
+HLS_HOT_DIR = "/dev/shm/hls_hot"
+HLS_HOT_MAX_BYTES = 1024 ** 3
+HLS_HOT_MAX_FRACTION = 0.5  # of the tmpfs size, which on a Pi is itself only half of RAM by default
+HLS_HOT_IDLE_SECONDS = 600
+HLS_HOT_HEADROOM_BYTES = 512 * 1024 ** 2  # kept free for the next job, so it need not wait for a demotion
+hls_tier_lock = threading.Lock()
+# A job on the hot tier reserves its estimated size here until it finishes, so jobs started together (by
+# this server or another one) cannot all fit into the same free space. The lock file serialises placement.
+HLS_HOT_RESERVATION = ".reserved"
+HLS_TIER_LOCK_FILE = os.path.join(HLS_LOCK_DIR, "hot-tier.lock")
+
+# Finished playlists and recently served store files in RAM, so viewers near the same playhead share one read
+HLS_MEMORY_CACHE_BYTES = 64 * 1024 ** 2
+HLS_MEMORY_MAX_FILE_BYTES = 8 * 1024 ** 2
+hls_memory = OrderedDict()
+hls_memory_bytes = 0
+hls_memory_lock = threading.Lock()
+
+# Page-cache readahead: WILLNEED hints for what each viewer will ask for after the file it just read
+READAHEAD_SEGMENTS = 3
+READAHEAD_MAX_TRACKED = 256
+readahead_advised = OrderedDict()  # path -> (first byte, end byte) hinted and not yet read
+readahead_stats = {"advised": 0, "advised_bytes": 0, "hits": 0, "misses": 0, "unused": 0}
+readahead_lock = threading.Lock()
+hls_playheads = {}  # (client, asset) -> (file, byte offset, last read)
+
+# Optional adaptive bitrate: remote/VPN viewers get a master playlist with transcoded renditions
+HLS_ABR = False
+ABR_NETWORKS = (ipaddress.ip_network("10.8.0.0/24"), ipaddress.ip_network("100.64.0.0/10"))
+HLS_RENDITIONS = {"720p": (720, 2500), "480p": (480, 1000)}  # height, video kbps
+abr_queue = queue.PriorityQueue()
+abr_order = itertools.count()
+abr_pending = set()
+
+# Trick play for finished remux assets: an I-frame-only playlist (TS segments) and WebVTT thumbnail sprites
+TRICKPLAY_ENABLED = True
+THUMB_INTERVAL = 10
+THUMB_WIDTH = 160
+THUMB_COLUMNS, THUMB_ROWS = 10, 10
+trickplay_queue = queue.Queue()
+
+# Idle-time pre-generation of likely next titles, at nice 19 / idle IO, paused while the box is busy
+PREFETCH_ENABLED = True
+PREFETCH_CHECK_SECONDS = 5
+PREFETCH_PICK_SECONDS = 60
+PREFETCH_NEW_ARRIVAL_DAYS = 14
+PREFETCH_HISTORY_DAYS = 7
+# The cast server touches this while a Chromecast reads from this box or plays something it cast
+CAST_ACTIVITY_FILE = os.path.join(APP_ROOT, "cast_activity")
+CAST_ACTIVITY_SECONDS = 60
+# Every HLS server touches this while one of its players is loaded, so playback on any of them pauses the
+# prefetch of all of them
+VIEWER_ACTIVITY_FILE = os.path.join(APP_ROOT, "viewer_activity")
+VIEWER_ACTIVITY_TOUCH_SECONDS = 5
+# A server waiting on an asset another server holds touches <asset>.wanted in HLS_LOCK_DIR; a prefetch job
+# there is then started over at normal priority instead of being left paused with the lock
+PREFETCH_WANTED_SECONDS = 30
+viewer_activity_touched = 0
+prefetch_restarts = set()
+watch_history = {"watched": {}, "folders": {}}
+
+# Resume points, reported by the player's session heartbeat and shared with the cast server
+WATCH_POSITIONS_FILE = os.path.join(APP_ROOT, "watch_positions.json")
+RESUME_MIN_SECONDS = 60
+RESUME_DONE_FRACTION = 0.95  # past this a title counts as watched and starts over next time
+watch_positions = {}
+positions_dirty = set()
+positions_lock = threading.Lock()
+prefetch_jobs = set()
+
+# ffprobe results per media file (stream info + delta-encoded keyframe table), shared via PROBE_INDEX_FILE
+PROBE_WORKERS = 2
+# Library indexing writes the shared file in batches; until then a probed file keeps its probe lock, so the
+# other servers do not probe it again
+PROBE_SAVE_FILES = 20
+PROBE_SAVE_SECONDS = 30
+probe_index = {}
+probe_index_mtime = 0  # of PROBE_INDEX_FILE as last read or written; the file is only parsed again when it moves
+probe_unsaved_locks = []
+probe_lock = threading.Lock()
+probe_pool = ThreadPoolExecutor(max_workers=PROBE_WORKERS)
+
+mimetypes.add_type('application/vnd.apple.mpegurl', '.m3u8')
+mimetypes.add_type('video/MP2T', '.ts')
+mimetypes.add_type('video/mp4', '.mp4')
+mimetypes.add_type('text/vtt', '.vtt')
+
+def clean_title(filename):
+    filename = os.path.splitext(filename)[0]
+    filename = re.sub(r'[\[\(].*?[\]\)]|\d{3,4}p|bluray|x264|dvdrip|hdtv|aac|mp3', '', filename, flags=re.IGNORECASE)
+    filename = re.sub(r'\d{4}', '', filename)
+    filename = re.sub(r'[\._\-]', ' ', filename)
+    return filename.strip()
+
+def fetch_movie_info(title):
+    if title in metadata_cache:
+        return metadata_cache[title]
+    url = f"http://www.omdbapi.com/?apikey={OMDB_API_KEY}&t={urllib.parse.quote(title)}"
+    try:
+        r = requests.get(url, timeout=10)
+        r.raise_for_status()
+        data = r.json()
+        if data.get("Response") == "True":
+            info = {
+                "Title": data.get("Title"),
+                "Year": data.get("Year"),
+                "IMDb Rating": data.get("imdbRating"),
+                "Plot": data.get("Plot"),
+                "Poster": data.get("Poster"),
+            }
+            metadata_cache[title] = info
+            return info
+    except: pass
+    return None
+
+def load_metadata():
+    global metadata_cache
+    if os.path.exists(CACHE_FILE):
+        try:
+            with open(CACHE_FILE, 'r') as f:
+                metadata_cache = json.load(f)
+        except: pass
+    for root, _, files in os.walk(MEDIA_DIR):
+        folder = os.path.relpath(root, MEDIA_DIR)
+        if SKIP_TV_FOLDERS and "TV" in folder.split(os.sep):
+            continue
+        if folder.lower() == "survivor":
+            continue  # Skip survivor folder in OMDb scan
+        for file in sorted(files):
+            if file.lower().endswith(VIDEO_EXTENSIONS):
+                title = clean_title(file)
+                if file not in movie_metadata[folder]:
+                    info = fetch_movie_info(title)
+                    if info:
+                        movie_metadata[folder][file] = info
+    try:
+        with open(CACHE_FILE, 'w') as f:
+            json.dump(metadata_cache, f, indent=2)
+    except: pass
+
+def playlist_text(playlist_path):
+    try:
+        with open(playlist_path, 'r') as f:
+            return f.read()
+    except OSError:
+        return ""
+
+def playlist_complete(playlist_path):
+    return "#EXT-X-ENDLIST" in playlist_text(playlist_path)
+
+def content_fingerprint(input_path, st):
+    digest = hashlib.sha1(f"{st.st_size}:{int(st.st_mtime)}".encode())
+    with open(input_path, 'rb') as f:
+        for offset in (0, st.st_size // 2, max(0, st.st_size - ASSET_SAMPLE_BYTES)):
+            f.seek(offset)
+            digest.update(f.read(ASSET_SAMPLE_BYTES))
+    return digest.hexdigest()[:20]
+
+def asset_id(input_path):
+    # From the probe index when it has the file, otherwise hashed once and remembered
+    try:
+        st = os.stat(input_path)
+    except OSError:
+        return None
+    entry = probe_index.get(os.path.relpath(input_path, MEDIA_DIR))
+    if entry and entry["size"] == st.st_size and entry["mtime"] == int(st.st_mtime) and entry.get("asset"):
+        return entry["asset"]
+    key = (input_path, st.st_size, int(st.st_mtime))
+    if key not in asset_ids:
+        try:
+            asset_ids[key] = content_fingerprint(input_path, st)
+        except OSError:
+            return None
+    return asset_ids[key]
+
+def asset_name(file_param):
+    return asset_id(os.path.abspath(os.path.join(MEDIA_DIR, urllib.parse.unquote(file_param))))
+
+def hls_lock(base_name):
+    # Claims an asset across servers; the kernel releases it if the holder dies mid-job
+    fd = os.open(os.path.join(HLS_LOCK_DIR, base_name + ".lock"), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        os.close(fd)
+        return None
+    return fd
+
+def hls_packaging(base_name):
+    # Our own job, or another server holding the asset's lock
+    if base_name in hls_jobs:
+        return True
+    if not os.path.exists(os.path.join(HLS_LOCK_DIR, base_name + ".lock")):
+        return False
+    fd = hls_lock(base_name)
+    if fd is None:
+        return True
+    os.close(fd)
+    return False
+
+def hot_assets():
+    try:
+        return [f for f in os.listdir(HLS_HOT_DIR) if os.path.islink(os.path.join(HLS_STORE_DIR, f))]
+    except OSError:
+        return []
+
+def hot_asset_bytes(base_name):
+    # An asset still being written counts at its estimated final size, not the little it holds so far.
+    # Returns that size and the part of it that is reserved but not written yet.
+    hot_dir = os.path.join(HLS_HOT_DIR, base_name)
+    size = dir_size(hot_dir)
+    try:
+        with open(os.path.join(hot_dir, HLS_HOT_RESERVATION), 'r') as f:
+            reserved = int(f.read())
+    except (OSError, ValueError):
+        return size, 0
+    if reserved <= size or not hls_packaging(base_name):
+        return size, 0
+    return reserved, reserved - size
+
+def hot_tier_usage():
+    usage = pending = 0
+    for base_name in hot_assets():
+        size, unwritten = hot_asset_bytes(base_name)
+        usage += size
+        pending += unwritten
+    return usage, pending
+
+def hot_tier_budget(usage, pending=0):
+    # The configured cap, bounded by what the tmpfs really has: its free space on top of what we already
+    # hold there (less what running jobs have yet to write), and a share of its size so the rest of
+    # /dev/shm keeps room
+    try:
+        st = os.statvfs(HLS_HOT_DIR)
+    except OSError:
+        return 0
+    free = st.f_bavail * st.f_frsize
+    return min(HLS_HOT_MAX_BYTES, usage - pending + free, int(st.f_blocks * st.f_frsize * HLS_HOT_MAX_FRACTION))
+
+def remove_asset_dir(base_name):
+    path = os.path.join(HLS_STORE_DIR, base_name)
+    if os.path.islink(path):
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+    else:
+        shutil.rmtree(path, ignore_errors=True)
+    shutil.rmtree(os.path.join(HLS_HOT_DIR, base_name), ignore_errors=True)
+
+def create_asset_dir(base_name, needed_bytes):
+    # Hot if tmpfs has room for the whole output, otherwise straight to disk
+    path = os.path.join(HLS_STORE_DIR, base_name)
+    if HLS_HOT_TIER and needed_bytes <= HLS_HOT_MAX_BYTES:
+        with hls_tier_lock:
+            tier_lock = os.open(HLS_TIER_LOCK_FILE, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(tier_lock, fcntl.LOCK_EX)
+                usage, pending = hot_tier_usage()
+                if usage + needed_bytes <= hot_tier_budget(usage, pending):
+                    hot_dir = os.path.join(HLS_HOT_DIR, base_name)
+                    try:
+                        os.makedirs(hot_dir, exist_ok=True)
+                        with open(os.path.join(hot_dir, HLS_HOT_RESERVATION), 'w') as f:
+                            f.write(str(needed_bytes))
+                        os.symlink(hot_dir, path)
+                        return
+                    except OSError:
+                        shutil.rmtree(hot_dir, ignore_errors=True)
+            finally:
+                os.close(tier_lock)
+    os.makedirs(path, exist_ok=True)
+
+def demote_asset(base_name):
+    # Copy beside the link, then swap the link for the copy; readers holding hot files keep them until closed
+    path = os.path.join(HLS_STORE_DIR, base_name)
+    hot_dir = os.path.join(HLS_HOT_DIR, base_name)
+    lock = hls_lock(base_name)
+    if lock is None:
+        return False
+    try:
+        if not os.path.islink(path):
+            return False
+        if not playlist_complete(os.path.join(hot_dir, "playlist.m3u8")):
+            remove_asset_dir(base_name)
+            print(f"🧹 Dropped incomplete {base_name} from the hot tier")
+            return True
+        tmp_dir = os.path.join(HLS_STORE_DIR, f".{base_name}.demote")
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        try:
+            shutil.copytree(hot_dir, tmp_dir)
+            os.unlink(path)
+            os.rename(tmp_dir, path)
+        except OSError as e:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            remove_asset_dir(base_name)
+            print(f"🧹 Dropped {base_name} from the hot tier: {e}")
+            return True
+        shutil.rmtree(hot_dir, ignore_errors=True)
+        print(f"💾 Moved {base_name} from the hot tier to disk")
+        return True
+    finally:
+        os.close(lock)
+
+def cool_hot_tier():
+    # Idle assets go to disk; past those, the coolest make way until there is headroom for a new job.
+    # Assets being watched or generated stay in RAM.
+    demote = []
+    with hls_tier_lock:
+        now = time.time()
+        usage, pending = hot_tier_usage()
+        budget = hot_tier_budget(usage, pending)
+        for base_name in sorted(hot_assets(), key=lambda f: hls_last_access.get(f, 0)):
+            idle = now - hls_last_access.get(base_name, 0) >= HLS_HOT_IDLE_SECONDS
+            if not idle and usage + HLS_HOT_HEADROOM_BYTES <= budget:
+                break
+            if hls_pinned(base_name, now) or hls_packaging(base_name):
+                continue
+            demote.append(base_name)
+            usage -= hot_asset_bytes(base_name)[0]
+    # The copies run outside the lock, so a title being started is never placed behind them.
+    # Each asset's own lock still keeps a job from starting on it mid-copy.
+    for base_name in demote:
+        demote_asset(base_name)
+
+def store_folders():
+    try:
+        return [
+            f for f in os.listdir(HLS_STORE_DIR)
+            if not f.startswith(".") and os.path.isdir(os.path.join(HLS_STORE_DIR, f))
+        ]
+    except OSError:
+        return []
+
+def library_files():
+    paths = []
+    for root, _, files in os.walk(MEDIA_DIR):
+        for file in sorted(files):
+            if file.lower().endswith(VIDEO_EXTENSIONS):
+                paths.append(os.path.join(root, file))
+    return paths
+
+def probe_file(input_path, keyframes=True, background=False):
+    # keyframes=False only reads the headers, for a quick look at codecs before the index has the file.
+    # The packet scan reads the whole file, so library indexing runs it at nice 19 / idle IO.
+    ffprobe = shutil.which("ffprobe") or "/usr/bin/ffprobe"
+    entries = "format=duration:stream=index,codec_type,codec_name,profile,width,height,channels"
+    cmd = [
+        ffprobe, "-v", "error", "-of", "compact",
+        "-show_entries", entries + (":packet=stream_index,pts_time,flags" if keyframes else ""), input_path
+    ]
+    if background:
+        cmd = background_cmd(cmd)
+    try:
+        out = subprocess.run(cmd, check=True, capture_output=True, text=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    streams, packets, duration = [], [], 0.0
+    for line in out.splitlines():
+        section, _, rest = line.partition("|")
+        fields = dict(kv.split("=", 1) for kv in rest.split("|") if "=" in kv)
+        if section == "packet":
+            if "K" in fields.get("flags", ""):
+                packets.append(fields)
+        elif section == "stream":
+            streams.append(fields)
+        elif section == "format":
+            try:
+                duration = float(fields.get("duration", 0))
+            except ValueError:
+                pass
+    video = next((st for st in streams if st.get("codec_type") == "video"), None)
+    audio = [st for st in streams if st.get("codec_type") == "audio"]
+    keyframes, last = [], 0
+    for packet in packets:
+        if video and packet.get("stream_index") == video.get("index"):
+            try:
+                ms = int(float(packet["pts_time"]) * 1000)
+            except (KeyError, ValueError):
+                continue
+            keyframes.append(ms - last)
+            last = ms
+    try:
+        st = os.stat(input_path)
+        asset = content_fingerprint(input_path, st)
+    except OSError:
+        return None
+    return {
+        "size": st.st_size,
+        "mtime": int(st.st_mtime),
+        "asset": asset,
+        "duration": duration,
+        "video": video and {
+            "codec": video.get("codec_name"), "profile": video.get("profile"),
+            "width": int(video.get("width") or 0), "height": int(video.get("height") or 0),
+        },
+        "audio": [{"codec": a.get("codec_name"), "channels": int(a.get("channels") or 0)} for a in audio],
+        "keyframes": keyframes,
+    }
+
+def probe_entry(input_path, wait=False):
+    key = os.path.relpath(input_path, MEDIA_DIR)
+    try:
+        st = os.stat(input_path)
+    except OSError:
+        return None
+    entry = probe_index.get(key)
+    if entry and entry["size"] == st.st_size and entry["mtime"] == int(st.st_mtime):
+        return entry
+    return index_file(input_path) if wait else None
+
+def index_file(input_path, background=False):
+    entry = probe_file(input_path, background=background)
+    if entry:
+        with probe_lock:
+            probe_index[os.path.relpath(input_path, MEDIA_DIR)] = entry
+        if HLS_MODE == "virtual":
+            mark_hls_changed(entry["asset"])
+    return entry
+
+def load_probe_index():
+    global probe_index, probe_index_mtime
+    try:
+        probe_index_mtime = os.path.getmtime(PROBE_INDEX_FILE)
+        with open(PROBE_INDEX_FILE, 'r') as f:
+            probe_index = json.load(f)
+    except (OSError, ValueError):
+        probe_index = {}
+
+def refresh_probe_index():
+    # Pick up what the other servers have probed since we last looked
+    global probe_index_mtime
+    try:
+        mtime = os.path.getmtime(PROBE_INDEX_FILE)
+        if mtime == probe_index_mtime:
+            return
+        with open(PROBE_INDEX_FILE, 'r') as f:
+            on_disk = json.load(f)
+    except (OSError, ValueError):
+        return
+    with probe_lock:
+        probe_index_mtime = mtime
+        for key, entry in on_disk.items():
+            ours = probe_index.get(key)
+            if not ours or (ours["size"], ours["mtime"]) != (entry["size"], entry["mtime"]):
+                probe_index[key] = entry
+
+def save_probe_index():
+    # Merge with what other servers have written since we loaded
+    global probe_index_mtime
+    with probe_lock:
+        try:
+            with open(PROBE_INDEX_FILE, 'r') as f:
+                merged = json.load(f)
+        except (OSError, ValueError):
+            merged = {}
+        merged.update(probe_index)
+        probe_index.update(merged)
+        tmp_path = PROBE_INDEX_FILE + f".{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(merged, f)
+            os.replace(tmp_path, PROBE_INDEX_FILE)
+            probe_index_mtime = os.path.getmtime(PROBE_INDEX_FILE)
+        except OSError:
+            pass
+
+def flush_probe_index():
+    with probe_lock:
+        locks = probe_unsaved_locks[:]
+        probe_unsaved_locks.clear()
+    if locks:
+        save_probe_index()
+    for lock in locks:
+        os.close(lock)
+
+def probe_index_saver():
+    while True:
+        time.sleep(PROBE_SAVE_SECONDS)
+        flush_probe_index()
+
+def index_library_file(input_path):
+    # Every server indexes the same library at startup: each file is probed by whichever gets to it
+    # first, and the others reuse that result from the shared index once its batch is saved
+    refresh_probe_index()
+    if probe_entry(input_path):
+        return
+    key = hashlib.sha1(os.path.relpath(input_path, MEDIA_DIR).encode()).hexdigest()[:20]
+    lock = hls_lock("probe-" + key)
+    if lock is None:
+        return  # another server is on it
+    batch = 0
+    try:
+        refresh_probe_index()
+        if not probe_entry(input_path) and index_file(input_path, background=True):
+            with probe_lock:
+                probe_unsaved_locks.append(lock)
+                batch = len(probe_unsaved_locks)
+    finally:
+        if not batch:
+            os.close(lock)
+    if batch >= PROBE_SAVE_FILES:
+        flush_probe_index()
+
+def index_library():
+    for path in library_files():
+        if not probe_entry(path):
+            probe_pool.submit(index_library_file, path)
+
+def keyframe_times(entry):
+    times, ms = [], 0
+    for delta in entry["keyframes"]:
+        ms += delta
+        times.append(ms / 1000.0)
+    return times
+
+def format_runtime(seconds):
+    minutes = int(seconds // 60)
+    return f"{minutes // 60}h {minutes % 60:02d}m" if minutes >= 60 else f"{minutes}m"
+
+def library_params():
+    # File params exactly as the page builds them (folder joined with filename)
+    params = [os.path.join(folder, file) for folder in list(movie_metadata) for file in list(movie_metadata[folder])]
+    survivor_folder = os.path.join(MEDIA_DIR, "survivor")
+    if os.path.isdir(survivor_folder) and "survivor" not in movie_metadata:
+        params += [
+            os.path.join("survivor", f) for f in sorted(os.listdir(survivor_folder))
+            if f.lower().endswith(VIDEO_EXTENSIONS)
+        ]
+    return params
+
+def mark_hls_changed(base_name):
+    global hls_state_version
+    with hls_state_lock:
+        hls_state_version += 1
+        hls_state_changes[base_name.split("@")[0]] = hls_state_version
+    drop_hls_memory(base_name)
+    hls_changed.set()
+
+def hls_memory_get(path):
+    with hls_memory_lock:
+        data = hls_memory.get(path)
+        if data is not None:
+            hls_memory.move_to_end(path)
+        return data
+
+def hls_memory_put(path, data):
+    global hls_memory_bytes
+    if len(data) > HLS_MEMORY_MAX_FILE_BYTES:
+        return
+    with hls_memory_lock:
+        if path in hls_memory:
+            hls_memory_bytes -= len(hls_memory.pop(path))
+        hls_memory[path] = data
+        hls_memory_bytes += len(data)
+        while hls_memory_bytes > HLS_MEMORY_CACHE_BYTES:
+            _, old = hls_memory.popitem(last=False)
+            hls_memory_bytes -= len(old)
+
+def hls_memory_load(path):
+    try:
+        if os.path.getsize(path) > HLS_MEMORY_MAX_FILE_BYTES:
+            return None
+        with open(path, 'rb') as f:
+            data = f.read()
+    except OSError:
+        return None
+    hls_memory_put(path, data)
+    return data
+
+def advise_willneed(path, offset=0, length=0):
+    # Starts the read in the background; the next request finds it in the page cache
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return 0
+    try:
+        size = os.fstat(fd).st_size
+        length = min(length or size, size - offset)
+        if length <= 0:
+            return 0
+        os.posix_fadvise(fd, offset, length, os.POSIX_FADV_WILLNEED)
+        return length
+    except (OSError, AttributeError):
+        return 0
+    finally:
+        os.close(fd)
+
+def readahead(client, base_name, name, span):
+    # TS assets hint the next few segment files, fMP4 single files the next few fragments' worth of bytes
+    hls_dir = os.path.join(HLS_STORE_DIR, base_name)
+    path = os.path.join(hls_dir, name)
+    start, end = span
+    match = re.match(r"playlist(\d+)\.ts$", name)
+    if match:
+        n = int(match.group(1))
+        upcoming = [(os.path.join(hls_dir, f"playlist{k}.ts"), 0, 0) for k in range(n + 1, n + 1 + READAHEAD_SEGMENTS)]
+    elif name.endswith(".mp4") and end > start:
+        upcoming = [(path, end + 1, (end - start + 1) * READAHEAD_SEGMENTS)]
+    else:
+        return
+    hls_playheads[(client, base_name)] = (name, start, time.time())
+    with readahead_lock:
+        hinted = readahead_advised.pop(path, None)
+        readahead_stats["hits" if hinted and hinted[0] <= start < hinted[1] else "misses"] += 1
+    for upcoming_path, offset, length in upcoming:
+        with readahead_lock:
+            if upcoming_path in readahead_advised:
+                continue
+        advised = advise_willneed(upcoming_path, offset, length)
+        if not advised:
+            continue
+        with readahead_lock:
+            readahead_advised[upcoming_path] = (offset, offset + advised)
+            readahead_stats["advised"] += 1
+            readahead_stats["advised_bytes"] += advised
+            while len(readahead_advised) > READAHEAD_MAX_TRACKED:
+                readahead_advised.popitem(last=False)
+                readahead_stats["unused"] += 1
+
+def hls_metrics():
+    now = time.time()
+    usage, pending = hot_tier_usage()
+    with readahead_lock:
+        stats = dict(readahead_stats)
+    reads = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = round(stats["hits"] / reads, 3) if reads else None
+    stats["readers"] = sum(1 for _, _, seen in list(hls_playheads.values()) if now - seen < HLS_SESSION_TIMEOUT)
+    return {
+        "readahead": stats,
+        "memory_cache": {"bytes": hls_memory_bytes, "entries": len(hls_memory)},
+        "hot_tier": {"bytes": usage, "assets": len(hot_assets()), "max_bytes": hot_tier_budget(usage, pending)},
+    }
+
+def drop_hls_memory(base_name):
+    # Anything cached for an asset goes when its job starts, lists a segment, finishes or is evicted
+    global hls_memory_bytes
+    prefix = os.path.join(HLS_STORE_DIR, base_name) + os.sep
+    with hls_memory_lock:
+        for path in [path for path in hls_memory if path.startswith(prefix)]:
+            hls_memory_bytes -= len(hls_memory.pop(path))
+
+def broadcast_event(kind, data):
+    message = f"event: {kind}\ndata: {json.dumps(data)}\n\n".encode()
+    with event_clients_lock:
+        for client in event_clients:
+            client.put(message)
+
+def hls_progress():
+    # Share of the probed duration already listed in each running job's playlist, ours or one we follow
+    progress = {}
+    for base_name in set(hls_jobs) | set(hls_foreign_jobs):
+        input_path = hls_sources.get(base_name)
+        entry = probe_entry(input_path) if input_path and "@" not in base_name else None
+        if not entry or not entry["duration"]:
+            continue
+        text = playlist_text(os.path.join(HLS_STORE_DIR, base_name, "playlist.m3u8"))
+        listed = sum(float(m) for m in re.findall(r"#EXTINF:([\d.]+)", text))
+        # Keyed like library_params() (folder joined with filename), so root titles come out as "./X.mp4"
+        key = os.path.join(os.path.relpath(os.path.dirname(input_path), MEDIA_DIR), os.path.basename(input_path))
+        progress[key] = min(99, int(listed * 100 / entry["duration"]))
+    return progress
+
+def hls_event_producer():
+    version = hls_state_version
+    while True:
+        hls_changed.wait(2)
+        hls_changed.clear()
+        if not event_clients:
+            version = hls_state_version
+            continue
+        if hls_state_version != version:
+            update = library_status(version, HLS_RUN_ID)
+            version = update["version"]
+            if update["statuses"]:
+                broadcast_event("hls", update)
+        progress = hls_progress()
+        if progress:
+            broadcast_event("progress", progress)
+
+def file_signature(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_size, st.st_mtime
+
+def library_watcher():
+    # A new file is only taken in once its size and mtime have held for a whole scan, so a copy or a
+    # watch_and_convert.py run still writing into media/ is not probed (and given up on) half-written
+    known = set(library_files())
+    arriving = {}
+    while True:
+        time.sleep(LIBRARY_SCAN_SECONDS)
+        current = set(library_files())
+        seen = {path: file_signature(path) for path in current - known}
+        added = {path for path, signature in seen.items() if signature and arriving.get(path) == signature}
+        arriving = {path: signature for path, signature in seen.items() if path not in added}
+        removed = known - current
+        if not added and not removed:
+            continue
+        known = (known - removed) | added
+        load_metadata()
+        for path in added:
+            probe_pool.submit(index_library_file, path)
+        broadcast_event("library", {"added": len(added)})
+
+def hls_status(file_param):
+    base_name = asset_name(file_param)
+    if not base_name:
+        return {"ready": False}
+    status = {"ready": hls_ready(file_param, base_name)}
+    if not status["ready"] and hls_packaging(base_name):
+        status["generating"] = True
+    if base_name in hls_errors:
+        status["error"] = hls_errors[base_name]
+    return status
+
+def library_status(since, run=None):
+    # A client that has never looked, or whose version is from a previous run, gets everything
+    version = hls_state_version
+    params = library_params()
+    if run == HLS_RUN_ID and 0 <= since <= version:
+        params = [f for f in params if hls_state_changes.get(asset_name(f), 0) > since]
+    return {"run": HLS_RUN_ID, "version": version, "statuses": {f: hls_status(f) for f in params}}
+
+def hls_ready(file_param, base_name):
+    # Ready as soon as the first segment is listed, while ffmpeg (ours or another server's) is still going
+    if HLS_MODE == "virtual":
+        return probe_entry(os.path.abspath(os.path.join(MEDIA_DIR, urllib.parse.unquote(file_param)))) is not None
+    playlist_path = os.path.join(HLS_STORE_DIR, base_name, "playlist.m3u8")
+    text = playlist_text(playlist_path)
+    return "#EXTINF" in text and ("#EXT-X-ENDLIST" in text or hls_packaging(base_name))
+
+def segment_schedule(duration=0):
+    # Short opening segments for a fast first frame, then the usual 10 second cuts
+    times = list(HLS_FAST_START_TIMES)
+    while times[-1] < (duration or HLS_MAX_SCHEDULE_SECONDS):
+        times.append(times[-1] + HLS_SEGMENT_SECONDS)
+    return ",".join(str(t) for t in times)
+
+def rendition_args(rendition, schedule):
+    height, kbps = HLS_RENDITIONS[rendition]
+    return [
+        "-map", "0:v:0", "-map", "0:a:0?", "-vf", f"scale=-2:{height}",
+        "-c:v", "libx264", "-preset", "veryfast", "-b:v", f"{kbps}k",
+        "-maxrate", f"{kbps}k", "-bufsize", f"{kbps * 2}k", "-force_key_frames", schedule,
+        "-c:a", "aac", "-b:a", "128k", "-ac", "2"
+    ]
+
+def audio_codec_args(info):
+    audio = (info.get("audio") or [{}])[0]
+    if not audio.get("codec") or audio["codec"] in BROWSER_AUDIO_CODECS:
+        return ["-c:a", "copy"]
+    return ["-c:a", "aac", "-b:a", "192k", "-ac", "2"]
+
+def packaging_args(input_path, schedule):
+    # Copy what the browser can play, transcode only the stream that it can't
+    info = probe_entry(input_path) or probe_file(input_path, keyframes=False) or {}
+    video = info.get("video") or {}
+    args = ["-map", "0:v:0", "-map", "0:a:0?"]
+    if not video.get("codec") or (video["codec"] in BROWSER_VIDEO_CODECS and "10" not in (video.get("profile") or "")):
+        args += ["-c:v", "copy"]
+    else:
+        args += [
+            "-c:v", "libx264", "-preset", "veryfast", "-crf", "22", "-pix_fmt", "yuv420p",
+            "-force_key_frames", schedule
+        ]
+    return args + audio_codec_args(info)
+
+def finish_hls_job(base_name, proc, output_path, log, lock):
+    while proc.poll() is None and "#EXTINF" not in playlist_text(output_path):
+        time.sleep(0.5)
+    mark_hls_changed(base_name)
+    proc.wait()
+    log.close()
+    restarted = base_name in prefetch_restarts
+    prefetch_restarts.discard(base_name)
+    try:
+        os.unlink(os.path.join(os.path.dirname(output_path), HLS_HOT_RESERVATION))
+    except OSError:
+        pass
+    if proc.returncode == 0:
+        if not playlist_complete(output_path):
+            with open(output_path, 'a') as f:
+                f.write("#EXT-X-ENDLIST\n")
+        hls_sizes[base_name] = dir_size(os.path.dirname(output_path))
+        if TRICKPLAY_ENABLED and "@" not in base_name:
+            trickplay_queue.put((base_name, hls_sources[base_name]))
+    elif not restarted:
+        lines = playlist_text(log.name).strip().splitlines()
+        hls_errors[base_name] = lines[-1] if lines else f"ffmpeg exited with {proc.returncode}"
+        print(f"❌ HLS packaging failed for {base_name}: {hls_errors[base_name]}")
+    os.close(lock)
+    hls_jobs.pop(base_name, None)
+    mark_hls_changed(base_name)
+
+def wait_for_first_segment(output_path, proc):
+    deadline = time.time() + HLS_FIRST_SEGMENT_TIMEOUT
+    while time.time() < deadline:
+        if "#EXTINF" in playlist_text(output_path) or (proc and proc.poll() is not None):
+            return
+        time.sleep(0.25)
+
+def generate_hls(input_path, hls_dir, rendition=None, background=False):
+    # Single flight per asset: concurrent callers wait on the one request starting the job
+    base_name = os.path.basename(hls_dir)
+    with hls_flights_lock:
+        flight = hls_flights.get(base_name)
+        leader = flight is None
+        if leader:
+            flight = hls_flights[base_name] = threading.Event()
+    if not leader:
+        flight.wait(HLS_FIRST_SEGMENT_TIMEOUT)
+        return
+    try:
+        start_hls_job(input_path, hls_dir, rendition, background)
+    finally:
+        with hls_flights_lock:
+            hls_flights.pop(base_name, None)
+        flight.set()
+
+def start_hls_job(input_path, hls_dir, rendition=None, background=False):
+    base_name = os.path.basename(hls_dir)
+    output_path = os.path.join(hls_dir, "playlist.m3u8")
+    proc = hls_jobs.get(base_name)
+    if proc:
+        wait_for_first_segment(output_path, proc)
+        return
+    if playlist_complete(output_path):
+        return
+    lock = hls_lock(base_name)
+    if lock is None:
+        # Another server is packaging the same content; share its output, and if that is a paused prefetch,
+        # have it started over for us
+        if not background:
+            touch_file(prefetch_wanted_path(base_name))
+        follow_foreign_job(base_name, input_path, output_path)
+        wait_for_first_segment(output_path, None)
+        return
+    if playlist_complete(output_path):
+        os.close(lock)
+        return
+    # A playlist without ENDLIST and nobody holding the lock is left over from a killed run
+    remove_asset_dir(base_name)
+    needed = estimated_hls_bytes(input_path, rendition)
+    evict_hls_cache(needed)
+    create_asset_dir(base_name, needed)
+    base_url = f"/hls_store/{base_name}/"
+    ffmpeg = shutil.which("ffmpeg") or "/usr/bin/ffmpeg"
+    schedule = segment_schedule((probe_entry(input_path) or {}).get("duration", 0))
+    codec_args = rendition_args(rendition, schedule) if rendition else packaging_args(input_path, schedule)
+    if HLS_SEGMENT_TYPE == "fmp4":
+        # hls_init_time is ignored for unbounded lists, so fMP4 uses short fragments throughout
+        output_args = [
+            "-f", "hls", "-hls_segment_type", "fmp4", "-hls_flags", "single_file+independent_segments",
+            "-hls_playlist_type", "event", "-hls_time", str(HLS_FMP4_SEGMENT_SECONDS),
+            "-hls_segment_filename", os.path.join(hls_dir, "media.mp4"), output_path
+        ]
+    else:
+        output_args = [
+            "-f", "segment", "-segment_format", "mpegts",
+            "-segment_times", schedule,
+            "-segment_list", output_path, "-segment_list_type", "m3u8",
+            "-segment_list_flags", "+live", "-segment_list_entry_prefix", base_url,
+            os.path.join(hls_dir, "playlist%d.ts")
+        ]
+    cmd = [ffmpeg, "-nostdin", "-loglevel", "error", "-i", input_path, *codec_args, *output_args]
+    if background:
+        cmd = background_cmd(cmd)
+    hls_errors.pop(base_name, None)
+    log = open(os.path.join(hls_dir, "ffmpeg.log"), 'wb')
+    try:
+        proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=log)
+    except OSError as e:
+        log.close()
+        os.close(lock)
+        hls_errors[base_name] = str(e)
+        return
+    hls_jobs[base_name] = proc
+    hls_sources[base_name] = input_path
+    mark_hls_changed(base_name)
+    threading.Thread(target=finish_hls_job, args=(base_name, proc, output_path, log, lock), daemon=True).start()
+    wait_for_first_segment(output_path, proc)
+
+def follow_foreign_job(base_name, input_path, output_path):
+    # Our state version only moves for our own jobs, so watch the other server's playlist and mark the
+    # asset changed at its first segment and at its end, as finish_hls_job does for ours
+    with hls_flights_lock:
+        if base_name in hls_foreign_jobs:
+            return
+        hls_foreign_jobs.add(base_name)
+    hls_sources[base_name] = input_path
+    threading.Thread(target=watch_foreign_job, args=(base_name, output_path), daemon=True).start()
+
+def watch_foreign_job(base_name, output_path):
+    listed = False
+    while True:
+        text = playlist_text(output_path)
+        if not listed and "#EXTINF" in text:
+            listed = True
+            mark_hls_changed(base_name)
+        if "#EXT-X-ENDLIST" in text or not hls_packaging(base_name):
+            break
+        time.sleep(1)
+    hls_foreign_jobs.discard(base_name)
+    mark_hls_changed(base_name)
+
+def background_cmd(cmd):
+    return ["nice", "-n", "19", *(["ionice", "-c", "3"] if shutil.which("ionice") else []), *cmd]
+
+def iframe_playlist(hls_dir, base_url, duration):
+    # One ffprobe over all segments through the concat protocol, then keyframe offsets mapped back per file
+    segments = [os.path.basename(line) for line in playlist_text(os.path.join(hls_dir, "playlist.m3u8")).splitlines()
+                if line.endswith(".ts")]
+    if not segments:
+        return None
+    starts, total = [], 0
+    for name in segments:
+        starts.append(total)
+        total += os.path.getsize(os.path.join(hls_dir, name))
+    ffprobe = shutil.which("ffprobe") or "/usr/bin/ffprobe"
+    cmd = [
+        ffprobe, "-v", "error", "-select_streams", "v:0", "-of", "compact", "-show_entries", "packet=pts_time,pos,flags",
+        "concat:" + "|".join(os.path.join(hls_dir, name) for name in segments)
+    ]
+    try:
+        out = subprocess.run(background_cmd(cmd), check=True, capture_output=True, text=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    packets = []
+    for line in out.splitlines():
+        fields = dict(kv.split("=", 1) for kv in line.split("|")[1:] if "=" in kv)
+        try:
+            packets.append((float(fields["pts_time"]), int(fields["pos"]), "K" in fields.get("flags", "")))
+        except (KeyError, ValueError):
+            continue
+    frames = []
+    for i, (pts, pos, key) in enumerate(packets):
+        if not key:
+            continue
+        n = bisect.bisect_right(starts, pos) - 1
+        seg_end = starts[n + 1] if n + 1 < len(starts) else total
+        end = min(packets[i + 1][1] if i + 1 < len(packets) else total, seg_end)
+        frames.append((pts, segments[n], pos - starts[n], end - pos))
+    if not frames:
+        return None
+    first = frames[0][0]
+    durations = [b[0] - a[0] for a, b in zip(frames, frames[1:])] + [max(0.0, duration - (frames[-1][0] - first))]
+    lines = [
+        "#EXTM3U", "#EXT-X-VERSION:4", "#EXT-X-PLAYLIST-TYPE:VOD", "#EXT-X-I-FRAMES-ONLY",
+        f"#EXT-X-TARGETDURATION:{int(max(durations)) + 1}", "#EXT-X-MEDIA-SEQUENCE:0"
+    ]
+    for (_, name, offset, length), frame_duration in zip(frames, durations):
+        lines += [f"#EXTINF:{frame_duration:.3f},", f"#EXT-X-BYTERANGE:{length}@{offset}", base_url + name]
+    lines.append("#EXT-X-ENDLIST")
+    return "\n".join(lines) + "\n"
+
+def thumbnail_track(input_path, hls_dir, base_url, entry):
+    # Sprite sheets of THUMB_COLUMNS x THUMB_ROWS frames, decoded from keyframes only, and the cues that crop them
+    video = entry.get("video") or {}
+    if not video.get("width") or not video.get("height") or not entry["duration"]:
+        return None
+    width = THUMB_WIDTH
+    height = int(width * video["height"] / video["width"]) // 2 * 2
+    ffmpeg = shutil.which("ffmpeg") or "/usr/bin/ffmpeg"
+    cmd = [
+        ffmpeg, "-nostdin", "-v", "error", "-skip_frame", "nokey", "-i", input_path, "-an", "-sn",
+        "-vf", f"fps=1/{THUMB_INTERVAL},scale={width}:{height},tile={THUMB_COLUMNS}x{THUMB_ROWS}",
+        "-vsync", "vfr", "-q:v", "5", os.path.join(hls_dir, "thumbs%d.jpg")
+    ]
+    try:
+        subprocess.run(background_cmd(cmd), check=True, capture_output=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    def timestamp(seconds):
+        return f"{int(seconds // 3600):02d}:{int(seconds % 3600 // 60):02d}:{seconds % 60:06.3f}"
+    per_sheet = THUMB_COLUMNS * THUMB_ROWS
+    lines = ["WEBVTT", ""]
+    for i in range(math.ceil(entry["duration"] / THUMB_INTERVAL)):
+        sheet, cell = divmod(i, per_sheet)
+        x, y = cell % THUMB_COLUMNS * width, cell // THUMB_COLUMNS * height
+        start, end = i * THUMB_INTERVAL, min((i + 1) * THUMB_INTERVAL, entry["duration"])
+        lines += [f"{timestamp(start)} --> {timestamp(end)}", f"{base_url}thumbs{sheet + 1}.jpg#xywh={x},{y},{width},{height}", ""]
+    return "\n".join(lines)
+
+def write_asset_file(path, text):
+    tmp_path = path + ".tmp"
+    try:
+        with open(tmp_path, 'w') as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+    except OSError:
+        pass
+
+def trickplay_worker():
+    # Runs after packaging at nice 19 / idle IO, one asset at a time
+    while True:
+        base_name, input_path = trickplay_queue.get()
+        hls_dir = os.path.join(HLS_STORE_DIR, base_name)
+        entry = probe_entry(input_path, wait=True)
+        if not entry or not os.path.isdir(hls_dir):
+            continue
+        base_url = f"/hls_store/{base_name}/"
+        if HLS_SEGMENT_TYPE == "mpegts":
+            playlist = iframe_playlist(hls_dir, base_url, entry["duration"])
+            if playlist:
+                write_asset_file(os.path.join(hls_dir, "iframes.m3u8"), playlist)
+        track = thumbnail_track(input_path, hls_dir, base_url, entry)
+        if track:
+            write_asset_file(os.path.join(hls_dir, "thumbs.vtt"), track)
+        if base_name in hls_sizes:
+            hls_sizes[base_name] = dir_size(hls_dir)
+
+def iframe_bandwidth(iframes_path):
+    text = playlist_text(iframes_path)
+    seconds = sum(float(m) for m in re.findall(r"#EXTINF:([\d.]+)", text))
+    total = sum(int(m) for m in re.findall(r"#EXT-X-BYTERANGE:(\d+)@", text))
+    return int(total * 8 / seconds) if seconds else 0
+
+def event_playlist(playlist_path, base_url):
+    # The segment muxer writes a bare live list; mark it EVENT so players keep every segment.
+    # The hls muxer writes relative URIs (fMP4 media and EXT-X-MAP), which are anchored to the asset here.
+    lines = []
+    for line in playlist_text(playlist_path).splitlines():
+        if line and not line.startswith(("#", "/")):
+            line = base_url + line
+        elif line.startswith('#EXT-X-MAP:URI="') and not line.startswith('#EXT-X-MAP:URI="/'):
+            line = line.replace('URI="', 'URI="' + base_url, 1)
+        lines.append(line)
+    text = "\n".join(lines) + "\n"
+    if "#EXT-X-PLAYLIST-TYPE" not in text:
+        text = text.replace("#EXTM3U\n", "#EXTM3U\n#EXT-X-PLAYLIST-TYPE:EVENT\n", 1)
+    return text
+
+def abr_client(ip):
+    try:
+        return any(ipaddress.ip_address(ip) in net for net in ABR_NETWORKS)
+    except ValueError:
+        return False
+
+def abr_ladder(input_path):
+    entry = probe_entry(input_path) or {}
+    height = (entry.get("video") or {}).get("height", 0)
+    return [name for name, (h, _) in HLS_RENDITIONS.items() if h < height]
+
+def master_playlist(input_path, file_param, abr=False):
+    # Source copy first, then the lower renditions (queued lowest bitrate first) and the I-frame stream
+    entry = probe_entry(input_path)
+    if not entry:
+        return None
+    ladder = abr_ladder(input_path) if abr else []
+    iframes_path = os.path.join(HLS_STORE_DIR, entry["asset"], "iframes.m3u8")
+    iframes = HLS_MODE == "remux" and os.path.exists(iframes_path)
+    if not ladder and not iframes:
+        return None
+    quoted = urllib.parse.quote(file_param)
+    video = entry["video"]
+    source_kbps = int(entry["size"] * 8 / 1000 / entry["duration"]) if entry["duration"] else 8000
+    lines = [
+        "#EXTM3U", "#EXT-X-VERSION:4",
+        f"#EXT-X-STREAM-INF:BANDWIDTH={source_kbps * 1000},RESOLUTION={video['width']}x{video['height']}",
+        f"/hls/playlist.m3u8?file={quoted}"
+    ]
+    for name in ladder:
+        height, kbps = HLS_RENDITIONS[name]
+        width = int(video["width"] * height / video["height"]) // 2 * 2
+        lines.append(f"#EXT-X-STREAM-INF:BANDWIDTH={(kbps + 128) * 1000},RESOLUTION={width}x{height}")
+        lines.append(f"/hls/playlist.m3u8?file={quoted}&rendition={name}")
+        key = entry["asset"] + "@" + name
+        if key not in abr_pending and key not in hls_jobs:
+            abr_pending.add(key)
+            abr_queue.put((kbps, next(abr_order), input_path, key, name))
+    if iframes:
+        lines.append(
+            f"#EXT-X-I-FRAME-STREAM-INF:BANDWIDTH={iframe_bandwidth(iframes_path)},"
+            f"RESOLUTION={video['width']}x{video['height']},URI=\"/hls_store/{entry['asset']}/iframes.m3u8\""
+        )
+    return "\n".join(lines) + "\n"
+
+def abr_worker():
+    # One background transcode at a time; a client asking for a rendition starts it directly
+    while True:
+        _, _, input_path, base_name, rendition = abr_queue.get()
+        hls_dir = os.path.join(HLS_STORE_DIR, base_name)
+        generate_hls(input_path, hls_dir, rendition)
+        proc = hls_jobs.get(base_name)
+        if proc:
+            proc.wait()
+        abr_pending.discard(base_name)
+
+def probe_keyframes(input_path):
+    entry = probe_entry(input_path, wait=True)
+    if not entry or not entry["keyframes"] or not entry["duration"]:
+        return None
+    cached = keyframe_index.get(input_path)
+    if not cached or cached[0] is not entry:
+        cached = keyframe_index[input_path] = (entry, keyframe_times(entry), entry["duration"])
+    return cached[1:]
+
+def virtual_segments(keyframes, duration):
+    # Cut at the first keyframe past each target, using the same fast-start schedule as remux
+    bounds = [0.0]
+    for kf in keyframes:
+        cut = len(bounds) - 1
+        target = HLS_FAST_START_TIMES[cut] if cut < len(HLS_FAST_START_TIMES) else bounds[-1] + HLS_SEGMENT_SECONDS
+        if kf >= target:
+            bounds.append(kf)
+    if duration > bounds[-1]:
+        bounds.append(duration)
+    return [(start, end - start) for start, end in zip(bounds, bounds[1:])]
+
+def virtual_playlist(input_path, base_name):
+    index = probe_keyframes(input_path)
+    if not index:
+        return None
+    segments = virtual_segments(*index)
+    vhls_sources[base_name] = input_path
+    lines = [
+        "#EXTM3U", "#EXT-X-VERSION:3", "#EXT-X-PLAYLIST-TYPE:VOD",
+        f"#EXT-X-TARGETDURATION:{int(max(d for _, d in segments)) + 1}", "#EXT-X-MEDIA-SEQUENCE:0"
+    ]
+    for n, (_, seg_duration) in enumerate(segments):
+        lines.append(f"#EXTINF:{seg_duration:.3f},")
+        lines.append(f"/vhls/{base_name}/{n}.ts")
+    lines.append("#EXT-X-ENDLIST")
+    return "\n".join(lines) + "\n"
+
+def cut_segment(input_path, start, seg_duration):
+    # The index holds absolute pts times; -seek_timestamp keeps -ss from being offset by the file's start_time
+    ffmpeg = shutil.which("ffmpeg") or "/usr/bin/ffmpeg"
+    cmd = [
+        ffmpeg, "-v", "error", "-seek_timestamp", "1", "-ss", f"{start + VHLS_SEEK_SLACK:.3f}", "-i", input_path,
+        "-t", f"{seg_duration - VHLS_SEEK_SLACK:.3f}",
+        "-map", "0:v:0", "-map", "0:a:0?", "-c:v", "copy", *audio_codec_args(probe_entry(input_path) or {}),
+        "-copyts", "-f", "mpegts", "pipe:1"
+    ]
+    try:
+        return subprocess.run(cmd, check=True, capture_output=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def virtual_segment(base_name, n):
+    input_path = vhls_sources.get(base_name)
+    index = probe_keyframes(input_path) if input_path else None
+    if not index:
+        return None
+    segments = virtual_segments(*index)
+    if n >= len(segments):
+        return None
+    key = (base_name, n)
+    with vhls_lock:
+        if key in vhls_cache:
+            vhls_cache.move_to_end(key)
+            return vhls_cache[key]
+        pending = vhls_pending.get(key)
+        leader = pending is None
+        if leader:
+            pending = vhls_pending[key] = threading.Event()
+    if not leader:
+        pending.wait()
+        return vhls_cache.get(key)
+    data = cut_segment(input_path, *segments[n])
+    with vhls_lock:
+        if data:
+            vhls_cache[key] = data
+            while len(vhls_cache) > VHLS_CACHE_SEGMENTS:
+                vhls_cache.popitem(last=False)
+        vhls_pending.pop(key, None)
+    pending.set()
+    return data
+
+def prefetch_virtual_segments(base_name, n):
+    for ahead in range(n + 1, n + 1 + VHLS_LOOKAHEAD):
+        virtual_segment(base_name, ahead)
+
+def dir_size(path):
+    total = 0
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_file(follow_symlinks=False):
+                    total += entry.stat(follow_symlinks=False).st_size
+    except OSError:
+        pass
+    return total
+
+def estimated_hls_bytes(input_path, rendition=None):
+    if rendition:
+        duration = (probe_entry(input_path) or {}).get("duration", 0)
+        return int((HLS_RENDITIONS[rendition][1] + 128) * 1000 / 8 * duration)
+    try:
+        return os.path.getsize(input_path)
+    except OSError:
+        return 0
+
+def hls_pinned(folder, now):
+    # Renditions share the pin of their source asset
+    asset = folder.split("@")[0]
+    if any(job == folder or job.split("@")[0] == asset for job in list(hls_jobs)):
+        return True
+    return now - hls_sessions.get(asset, 0) < HLS_SESSION_TIMEOUT
+
+def evict_hls_cache(needed_bytes=0):
+    # Least recently accessed first, skipping assets someone is watching or generating
+    with hls_cache_lock:
+        now = time.time()
+        folders = store_folders()
+        sizes = {
+            f: hls_sizes[f] if f in hls_sizes and f not in hls_jobs else dir_size(os.path.join(HLS_STORE_DIR, f))
+            for f in folders
+        }
+        total = sum(sizes.values())
+        def last_access(folder):
+            try:
+                return hls_last_access.get(folder) or os.path.getmtime(os.path.join(HLS_STORE_DIR, folder))
+            except OSError:
+                return 0
+        for folder in sorted(folders, key=last_access):
+            if total + needed_bytes <= HLS_CACHE_MAX_BYTES:
+                break
+            if hls_pinned(folder, now) or hls_packaging(folder):
+                continue
+            remove_asset_dir(folder)
+            hls_last_access.pop(folder, None)
+            hls_sizes.pop(folder, None)
+            mark_hls_changed(folder)
+            total -= sizes[folder]
+            print(f"🧹 Evicted {folder} from HLS cache")
+
+def natural_key(s):
+    return [int(text) if text.isdigit() else text.lower() for text in re.split(r'(\d+)', s)]
+
+def record_watch(file_param):
+    now = time.time()
+    watch_history["watched"][file_param] = now
+    watch_history["folders"][os.path.dirname(file_param) or "."] = now
+
+def load_watch_history():
+    try:
+        with open(HLS_HISTORY_FILE, 'r') as f:
+            watch_history.update(json.load(f))
+    except (OSError, ValueError):
+        pass
+
+def save_watch_history():
+    tmp_path = HLS_HISTORY_FILE + ".tmp"
+    try:
+        with open(tmp_path, 'w') as f:
+            json.dump(watch_history, f)
+        os.replace(tmp_path, HLS_HISTORY_FILE)
+    except OSError:
+        pass
+
+def record_position(file_param, position, duration, completed=False):
+    # Kept in memory; sync_positions writes them out in batches
+    if not file_param or not duration:
+        return
+    file_param = os.path.normpath(file_param)
+    completed = completed or position >= duration * RESUME_DONE_FRACTION
+    with positions_lock:
+        entry = watch_positions.get(file_param, {})
+        updated = {
+            "position": 0 if completed else round(position, 1),
+            "duration": round(duration, 1),
+            "completed": completed or entry.get("completed", False),
+        }
+        if all(entry.get(key) == value for key, value in updated.items()):
+            return
+        updated["updated"] = time.time()
+        watch_positions[file_param] = updated
+        positions_dirty.add(file_param)
+
+def resume_position(file_param):
+    entry = watch_positions.get(os.path.normpath(file_param))
+    if not entry or entry["position"] < RESUME_MIN_SECONDS:
+        return 0
+    return entry["position"]
+
+def sync_positions():
+    with positions_lock:
+        changed = {path: watch_positions[path] for path in positions_dirty}
+        positions_dirty.clear()
+    # The cast server and the other HLS servers write the same file; the newer entry for each title wins
+    try:
+        with open(WATCH_POSITIONS_FILE, 'r') as f:
+            stored = json.load(f)
+    except (OSError, ValueError):
+        stored = {}
+    for path, entry in changed.items():
+        if entry["updated"] >= stored.get(path, {}).get("updated", 0):
+            stored[path] = entry
+    if changed:
+        tmp_path = f"{WATCH_POSITIONS_FILE}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(stored, f)
+            os.replace(tmp_path, WATCH_POSITIONS_FILE)
+        except OSError:
+            pass
+    with positions_lock:
+        for path, entry in stored.items():
+            if path not in positions_dirty and entry["updated"] > watch_positions.get(path, {}).get("updated", 0):
+                watch_positions[path] = entry
+
+def prefetch_candidates():
+    # Next episode of recent watches > new arrivals > the rest of recently used folders
+    now = time.time()
+    def recency(seen, days):
+        return max(0.0, 1 - (now - seen) / (days * 86400))
+    by_folder = defaultdict(list)
+    for file_param in library_params():
+        by_folder[os.path.dirname(file_param) or "."].append(file_param)
+    for files in by_folder.values():
+        files.sort(key=natural_key)
+    scores = defaultdict(float)
+    for watched, seen in watch_history["watched"].items():
+        siblings = by_folder.get(os.path.dirname(watched) or ".", [])
+        if watched in siblings and siblings.index(watched) + 1 < len(siblings):
+            scores[siblings[siblings.index(watched) + 1]] += 3 * recency(seen, PREFETCH_HISTORY_DAYS)
+    for files in by_folder.values():
+        for file_param in files:
+            try:
+                added = os.path.getmtime(os.path.join(MEDIA_DIR, file_param))
+            except OSError:
+                continue
+            scores[file_param] += 2 * recency(added, PREFETCH_NEW_ARRIVAL_DAYS)
+    for folder, seen in watch_history["folders"].items():
+        for file_param in by_folder.get(folder, []):
+            scores[file_param] += recency(seen, PREFETCH_HISTORY_DAYS)
+    ranked = []
+    for file_param, score in sorted(scores.items(), key=lambda item: item[1], reverse=True):
+        if score <= 0 or file_param in watch_history["watched"]:
+            continue
+        base_name = asset_name(file_param)
+        if not base_name or base_name in hls_sizes or hls_packaging(base_name):
+            continue
+        ranked.append(file_param)
+    return ranked
+
+def touch_file(path):
+    try:
+        with open(path, 'a'):
+            pass
+        os.utime(path)
+    except OSError:
+        pass
+
+def touched_within(path, seconds):
+    try:
+        return time.time() - os.path.getmtime(path) < seconds
+    except OSError:
+        return False
+
+def mark_cast_activity():
+    touch_file(CAST_ACTIVITY_FILE)
+
+def cast_activity():
+    return touched_within(CAST_ACTIVITY_FILE, CAST_ACTIVITY_SECONDS)
+
+def mark_viewer_activity():
+    # Called on every heartbeat and segment read, so the file is only touched every few seconds
+    global viewer_activity_touched
+    now = time.time()
+    if now - viewer_activity_touched >= VIEWER_ACTIVITY_TOUCH_SECONDS:
+        viewer_activity_touched = now
+        touch_file(VIEWER_ACTIVITY_FILE)
+
+def viewer_activity():
+    return touched_within(VIEWER_ACTIVITY_FILE, HLS_SESSION_TIMEOUT)
+
+def prefetch_wanted_path(base_name):
+    return os.path.join(HLS_LOCK_DIR, base_name + ".wanted")
+
+def external_activity():
+    # A recording (ffmpeg pulling a remote stream) or a catt cast (TV.py) serving from this box
+    for pid in os.listdir("/proc"):
+        if not pid.isdigit():
+            continue
+        try:
+            with open(f"/proc/{pid}/cmdline", "rb") as f:
+                args = [a.decode(errors="ignore") for a in f.read().split(b"\0") if a]
+        except OSError:
+            continue
+        names = [os.path.basename(a) for a in args[:2]]
+        if "ffmpeg" in names and any(a.startswith(("http://", "https://")) for a in args):
+            return True
+        if "catt" in names and "cast" in args:
+            return True
+    return False
+
+def machine_busy():
+    now = time.time()
+    if any(now - seen < HLS_SESSION_TIMEOUT for seen in list(hls_sessions.values())):
+        return True
+    if any(job not in prefetch_jobs for job in list(hls_jobs)):
+        return True
+    return viewer_activity() or cast_activity() or external_activity()
+
+def promote_prefetch(base_name):
+    # Someone asked for it: the job is no longer optional. It runs at nice 19 / idle IO, which an unprivileged
+    # process cannot raise again, so it is stopped here and the caller starts it over at normal priority.
+    if base_name not in prefetch_jobs:
+        return
+    prefetch_jobs.discard(base_name)
+    proc = hls_jobs.get(base_name)
+    if not proc:
+        return
+    prefetch_restarts.add(base_name)
+    proc.send_signal(signal.SIGCONT)
+    proc.terminate()
+    # finish_hls_job releases the asset lock before it drops the job, so a restart can take it straight away
+    deadline = time.time() + HLS_FIRST_SEGMENT_TIMEOUT
+    while base_name in hls_jobs and time.time() < deadline:
+        time.sleep(0.1)
+
+def hls_cache_usage():
+    running = sum(dir_size(os.path.join(HLS_STORE_DIR, job)) for job in list(hls_jobs))
+    return sum(hls_sizes.values()) + running
+
+def prefetch_worker():
+    last_pick = 0
+    while True:
+        time.sleep(PREFETCH_CHECK_SECONDS)
+        busy = machine_busy()
+        for base_name in list(prefetch_jobs):
+            proc = hls_jobs.get(base_name)
+            if not proc:
+                prefetch_jobs.discard(base_name)
+                continue
+            if touched_within(prefetch_wanted_path(base_name), PREFETCH_WANTED_SECONDS):
+                # A viewer on another server is waiting on this one
+                input_path = hls_sources[base_name]
+                promote_prefetch(base_name)
+                threading.Thread(
+                    target=generate_hls, args=(input_path, os.path.join(HLS_STORE_DIR, base_name)), daemon=True
+                ).start()
+                continue
+            proc.send_signal(signal.SIGSTOP if busy else signal.SIGCONT)
+        if busy or prefetch_jobs or time.time() - last_pick < PREFETCH_PICK_SECONDS:
+            continue
+        last_pick = time.time()
+        free = HLS_CACHE_MAX_BYTES - hls_cache_usage()
+        for file_param in prefetch_candidates():
+            src_path = os.path.join(MEDIA_DIR, file_param)
+            if estimated_hls_bytes(src_path) > free:
+                continue
+            base_name = asset_name(file_param)
+            print(f"🔮 Pre-generating {file_param}")
+            prefetch_jobs.add(base_name)
+            generate_hls(src_path, os.path.join(HLS_STORE_DIR, base_name), background=True)
+            break
+
+def save_hls_catalogue():
+    # The store is shared: adopt what other servers finished, drop what they evicted, keep the newest access
+    try:
+        with open(HLS_CATALOGUE_FILE, 'r') as f:
+            on_disk = json.load(f)
+    except (OSError, ValueError):
+        on_disk = {}
+    # Either way the asset's readiness changed without a job of ours, so the pages have to hear about it
+    for folder, info in on_disk.items():
+        if folder not in hls_sizes and playlist_complete(os.path.join(HLS_STORE_DIR, folder, "playlist.m3u8")):
+            hls_sizes[folder] = info.get("bytes", 0)
+            mark_hls_changed(folder)
+        if info.get("last_access", 0) > hls_last_access.get(folder, 0):
+            hls_last_access[folder] = info["last_access"]
+    for folder in list(hls_sizes):
+        if not os.path.isdir(os.path.join(HLS_STORE_DIR, folder)):
+            hls_sizes.pop(folder, None)
+            hls_last_access.pop(folder, None)
+            mark_hls_changed(folder)
+    catalogue = {
+        folder: {"last_access": hls_last_access.get(folder, 0), "bytes": size}
+        for folder, size in list(hls_sizes.items())
+    }
+    tmp_path = HLS_CATALOGUE_FILE + f".{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, 'w') as f:
+            json.dump(catalogue, f)
+        os.replace(tmp_path, HLS_CATALOGUE_FILE)
+    except OSError:
+        pass
+
+def remove_legacy_hls_dirs():
+    # Left behind by the per-server layout; nothing reads them since the move to hls_store
+    for name in LEGACY_HLS_DIRS:
+        path = os.path.join(APP_ROOT, name)
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+            print(f"🧹 Removed {path}, superseded by {HLS_STORE_DIR}")
+
+def reconcile_hls_cache():
+    # Adopt finished assets and drop the ones ffmpeg never completed, unless another server is still on them
+    try:
+        with open(HLS_CATALOGUE_FILE, 'r') as f:
+            catalogue = json.load(f)
+    except (OSError, ValueError):
+        catalogue = {}
+    adopted = removed = 0
+    # tmpfs does not survive a reboot: drop links to hot assets that are gone, and hot assets nothing links to
+    for name in os.listdir(HLS_STORE_DIR):
+        link = os.path.join(HLS_STORE_DIR, name)
+        if os.path.islink(link) and not os.path.isdir(link):
+            os.unlink(link)
+    if os.path.isdir(HLS_HOT_DIR):
+        for name in os.listdir(HLS_HOT_DIR):
+            if not os.path.islink(os.path.join(HLS_STORE_DIR, name)):
+                shutil.rmtree(os.path.join(HLS_HOT_DIR, name), ignore_errors=True)
+    for folder in store_folders():
+        hls_dir = os.path.join(HLS_STORE_DIR, folder)
+        if hls_packaging(folder):
+            continue
+        if playlist_complete(os.path.join(hls_dir, "playlist.m3u8")):
+            hls_last_access[folder] = catalogue.get(folder, {}).get("last_access") or os.path.getmtime(hls_dir)
+            hls_sizes[folder] = dir_size(hls_dir)
+            adopted += 1
+        else:
+            remove_asset_dir(folder)
+            removed += 1
+    save_hls_catalogue()
+    print(f"🗂 HLS cache: adopted {adopted} ({sum(hls_sizes.values()) // 1024 ** 2} MB), removed {removed} incomplete")
+
+def cleanup_old_hls():
+    while True:
+        time.sleep(60)
+        now = time.time()
+        for folder in list(hls_last_access.keys()):
+            if now - hls_last_access[folder] > HLS_EXPIRATION_SECONDS and not hls_pinned(folder, now):
+                if hls_packaging(folder):
+                    continue
+                remove_asset_dir(folder)
+                hls_last_access.pop(folder)
+                hls_sizes.pop(folder, None)
+                mark_hls_changed(folder)
+        for asset in [a for a, seen in list(hls_sessions.items()) if now - seen > HLS_SESSION_TIMEOUT]:
+            hls_sessions.pop(asset, None)
+        for key in [k for k, (_, _, seen) in list(hls_playheads.items()) if now - seen > HLS_SESSION_TIMEOUT]:
+            hls_playheads.pop(key, None)
+        evict_hls_cache()
+        if HLS_HOT_TIER:
+            cool_hot_tier()
+        save_hls_catalogue()
+        save_watch_history()
+        sync_positions()
+
+class HLSHandler(SimpleHTTPRequestHandler):
+    def client_ip(self):
+        return self.client_address[0]
+
+    def page_html(self):
+        return generate_html()
+
+    def send_playlist(self, playlist):
+        body = playlist if isinstance(playlist, bytes) else playlist.encode()
+        self.send_response(200)
+        self.send_header("Content-type", "application/vnd.apple.mpegurl")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_range_headers(self, path, size):
+        # Byte-range aware, so fMP4 single-file assets can be read fragment by fragment
+        start, end = 0, size - 1
+        match = re.match(r"bytes=(\d*)-(\d*)$", self.headers.get("Range", ""))
+        if match and (match.group(1) or match.group(2)):
+            if match.group(1):
+                start = int(match.group(1))
+                end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+            else:
+                start = max(0, size - int(match.group(2)))
+            if start > end:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{size}")
+                self.end_headers()
+                return None
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        else:
+            self.send_response(200)
+        self.send_header("Content-type", self.guess_type(path))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.end_headers()
+        return start, end
+
+    def send_hls_file(self, path, cacheable=False):
+        data = hls_memory_get(path)
+        if data is None and cacheable:
+            data = hls_memory_load(path)
+        if data is not None:
+            span = self.send_range_headers(path, len(data))
+            if span:
+                self.wfile.write(data[span[0]:span[1] + 1])
+            return span
+        try:
+            f = open(path, 'rb')
+        except OSError:
+            return self.send_error(404)
+        with f:
+            span = self.send_range_headers(path, os.fstat(f.fileno()).st_size)
+            if not span:
+                return None
+            f.seek(span[0])
+            remaining = span[1] - span[0] + 1
+            while remaining > 0:
+                chunk = f.read(min(64 * 1024, remaining))
+                if not chunk:
+                    break
+                self.wfile.write(chunk)
+                remaining -= len(chunk)
+        return span
+
+    def stream_events(self):
+        self.send_response(200)
+        self.send_header("Content-type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        client = queue.Queue()
+        with event_clients_lock:
+            event_clients.append(client)
+        try:
+            while True:
+                try:
+                    message = client.get(timeout=EVENT_KEEPALIVE_SECONDS)
+                except queue.Empty:
+                    message = b": keepalive\n\n"
+                self.wfile.write(message)
+                self.wfile.flush()
+        except OSError:
+            pass
+        finally:
+            with event_clients_lock:
+                event_clients.remove(client)
+
+    def send_json(self, data):
+        body = json.dumps(data).encode()
+        self.send_response(200)
+        self.send_header("Content-type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        # Batch status: {"files": [...]} in, {"run": id, "version": n, "statuses": {file: status}} out
+        parsed = urllib.parse.urlparse(self.path)
+        if parsed.path != "/hls_status":
+            return self.send_error(404)
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            files = json.loads(self.rfile.read(length) or b"{}").get("files", [])
+        except (ValueError, AttributeError):
+            files = None
+        if not isinstance(files, list):
+            return self.send_error(400, "Expected {\"files\": [...]}")
+        statuses = {f: hls_status(f) for f in files[:HLS_STATUS_BATCH_LIMIT] if isinstance(f, str)}
+        self.send_json({"run": HLS_RUN_ID, "version": hls_state_version, "statuses": statuses})
+
+    def do_GET(self):
+        parsed = urllib.parse.urlparse(self.path)
+        params = urllib.parse.parse_qs(parsed.query)
+
+        if parsed.path == "/hls_status":
+            file_param = params.get("file", [None])[0]
+            if file_param:
+                self.send_json(hls_status(file_param))
+            return
+
+        elif parsed.path == "/events":
+            return self.stream_events()
+
+        elif parsed.path == "/hls_metrics":
+            return self.send_json(hls_metrics())
+
+        elif parsed.path == "/hls_library":
+            try:
+                since = int(params.get("since", ["0"])[0])
+            except ValueError:
+                since = 0
+            return self.send_json(library_status(since, params.get("run", [None])[0]))
+
+        elif parsed.path.startswith("/hls/playlist.m3u8"):
+            file_param = params.get("file", [None])[0]
+            if file_param:
+                src_path = os.path.abspath(os.path.join(MEDIA_DIR, urllib.parse.unquote(file_param)))
+                base_name = asset_id(src_path)
+                if base_name:
+                    if HLS_MODE == "virtual":
+                        playlist = virtual_playlist(src_path, base_name)
+                        if playlist:
+                            return self.send_playlist(playlist)
+                        return self.send_error(500, "Could not index keyframes")
+                    rendition = params.get("rendition", [None])[0]
+                    if HLS_ABR and rendition in HLS_RENDITIONS:
+                        base_name += "@" + rendition
+                    else:
+                        rendition = None
+                    hls_dir = os.path.join(HLS_STORE_DIR, base_name)
+                    if not rendition:
+                        record_watch(file_param)
+                    promote_prefetch(base_name)
+                    hls_last_access[base_name] = time.time()
+                    playlist_path = os.path.join(hls_dir, "playlist.m3u8")
+                    # A finished playlist never changes, so the rewritten copy is answered from RAM until invalidated
+                    served_key = os.path.join(hls_dir, "served.m3u8")
+                    playlist = hls_memory_get(served_key)
+                    if playlist is not None and os.path.isdir(hls_dir):
+                        return self.send_playlist(playlist)
+                    generate_hls(src_path, hls_dir, rendition)
+                    if os.path.exists(playlist_path):
+                        playlist = event_playlist(playlist_path, f"/hls_store/{base_name}/").encode()
+                        if b"#EXT-X-ENDLIST" in playlist:
+                            hls_memory_put(served_key, playlist)
+                        return self.send_playlist(playlist)
+            self.send_error(404)
+
+        elif parsed.path == "/hls_session":
+            file_param = params.get("file", [None])[0]
+            base_name = asset_name(file_param) if file_param else None
+            if base_name:
+                hls_sessions[base_name] = time.time()
+                mark_viewer_activity()
+                try:
+                    record_position(file_param, float(params.get("t", [0])[0]), float(params.get("d", [0])[0]))
+                except ValueError:
+                    pass
+            self.send_response(204)
+            self.end_headers()
+
+        elif parsed.path == "/hls_resume":
+            file_param = params.get("file", [None])[0]
+            return self.send_json({"position": resume_position(file_param) if file_param else 0})
+
+        elif parsed.path.startswith("/hls/master.m3u8"):
+            file_param = params.get("file", [None])[0]
+            if not file_param:
+                return self.send_error(404)
+            src_path = os.path.abspath(os.path.join(MEDIA_DIR, urllib.parse.unquote(file_param)))
+            abr = HLS_ABR and HLS_MODE == "remux" and abr_client(self.client_ip())
+            master = master_playlist(src_path, file_param, abr)
+            if master:
+                return self.send_playlist(master)
+            self.send_response(302)
+            self.send_header("Location", f"/hls/playlist.m3u8?file={urllib.parse.quote(file_param)}")
+            self.end_headers()
+
+        elif parsed.path == "/hls/thumbs.vtt":
+            file_param = params.get("file", [None])[0]
+            base_name = asset_name(file_param) if file_param else None
+            if not base_name:
+                return self.send_error(404)
+            return self.send_hls_file(os.path.join(HLS_STORE_DIR, base_name, "thumbs.vtt"), cacheable=True)
+
+        elif parsed.path.startswith("/vhls/"):
+            match = re.match(r"/vhls/([^/]+)/(\d+)\.ts$", parsed.path)
+            data = virtual_segment(match.group(1), int(match.group(2))) if match else None
+            if not data:
+                return self.send_error(404)
+            mark_viewer_activity()
+            self.send_response(200)
+            self.send_header("Content-type", "video/MP2T")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            threading.Thread(
+                target=prefetch_virtual_segments, args=(match.group(1), int(match.group(2))), daemon=True
+            ).start()
+
+        elif parsed.path.startswith("/hls_store/"):
+            match = re.match(r"/hls_store/([\w\-@]+)/(\w[\w\-.]*)$", parsed.path)
+            if not match:
+                return self.send_error(404)
+            hls_last_access[match.group(1)] = time.time()
+            mark_viewer_activity()
+            span = self.send_hls_file(
+                os.path.join(HLS_STORE_DIR, match.group(1), match.group(2)), cacheable=not hls_packaging(match.group(1))
+            )
+            if span:
+                readahead(self.client_ip(), match.group(1), match.group(2), span)
+
+        elif parsed.path == "/" or parsed.path == "/index.html":
+            self.send_response(200)
+            self.send_header("Content-type", "text/html")
+            self.end_headers()
+            self.wfile.write(self.page_html().encode())
+
+        else:
+            return SimpleHTTPRequestHandler.do_GET(self)
+
+def generate_html(tv_url=None):
+    def movie_div(path, poster, title, plot="", show_imdb=False, imdb=""):
+        entry = probe_entry(os.path.join(MEDIA_DIR, urllib.parse.unquote(path)))
+        runtime = f"<br>{format_runtime(entry['duration'])}" if entry and entry["duration"] else ""
+        plot_html = f'<div class="plot-overlay">{plot}</div>' if plot else ''
+        return f'''
+        <div class="movie" data-path="{path}" onclick="handleClick(this)">
+            <div class="flag"></div>
+            <img src="{poster}" alt="{title}">
+            {plot_html}
+            <div class="meta"><strong>{title}</strong>{'<br>IMDB ' + imdb if show_imdb else ''}{runtime}</div>
+        </div>'''
+
+
+    # Survivor Row
+    survivor_folder = os.path.join(MEDIA_DIR, "survivor")
+    survivor_row = ""
+    if os.path.isdir(survivor_folder):
+        files = [f for f in sorted(os.listdir(survivor_folder)) if f.lower().endswith(VIDEO_EXTENSIONS)]
+        row = ""
+        for filename in files:
+            title = os.path.splitext(filename)[0]
+            rel_path = urllib.parse.quote(os.path.join("survivor", filename))
+            row += movie_div(rel_path, "https://plus.unsplash.com/premium_photo-1710409625244-e9ed7e98f67b?fm=jpg&q=60&w=3000&ixlib=rb-4.0.3&ixid=M3wxMjA3fDB8MHxwaG90by1yZWxhdGVkfDF8fHxlbnwwfHx8fHw%3D", title)
+        if row:
+            survivor_row = f"<h2>Saves</h2><div class='banner'>{row}</div>"
+
+    # Standard Movies
+    standard_rows = ""
+    for folder in sorted(k for k in movie_metadata if k != "survivor"):
+        movies = movie_metadata[folder]
+        row = ""
+        for filename, meta in movies.items():
+            rel_path = urllib.parse.quote(os.path.join(folder, filename))
+            plot = meta['Plot'].replace('"', '&quot;')
+            row += movie_div(rel_path, meta['Poster'], meta['Title'], plot=plot, show_imdb=True, imdb=meta['IMDb Rating'])
+        if row:
+            standard_rows += f"<h2>{folder}</h2><div class='banner'>{row}</div>"
+
+    # Link to the TV show browser, where the server has one
+    tv_row = f"""
+            <h2>TV Shows</h2>
+            <div class='banner'>
+                <div class="movie">
+                    <a href="{tv_url}">
+                        <img src="https://variety.com/wp-content/uploads/2024/01/100-Greatest-TV-Shows-V1-2.jpg?w=1024" alt="TV Shows" style="width: 300px; border-radius: 10px; box-shadow: 2px 2px 8px #000;">
+                    </a>
+                    <div class="meta"><strong><br>Select to see shows</strong></div>
+                </div>
+            </div>""" if tv_url else ""
+    favicon = f'<link rel="icon" href="{FAVICON_URL}" type="image/x-icon">' if FAVICON_URL else ""
+
+    return f"""
+    <html>
+    <head>
+        <title>Movie Streamer</title>
+        {favicon}
+        <meta name="viewport" content="width=device-width, initial-scale=1">
+        <script src="https://cdn.jsdelivr.net/npm/hls.js@latest"></script>
+        <style>
+            body {{ background: #111; color: #eee; font-family: sans-serif; padding: 2vw; }}
+            h1 {{ color: hotpink; }}
+            h2 {{ color: #6cf; }}
+            .banner {{ display: flex; overflow-x: auto; gap: 20px; padding: 1vw; }}
+            .movie {{
+                position: relative;
+                flex: 0 0 auto;
+                width: 160px;
+                text-align: center;
+                cursor: pointer;
+            }}
+            .movie img {{
+                width: 100%;
+                border-radius: 1em;
+                box-shadow: 0 0 10px #000;
+                transition: transform 0.2s ease;
+            }}
+            .movie:hover img {{ transform: scale(1.05); }}
+	   .plot-overlay {{ display: none; position: absolute; top: 0; left: 170px; width: 280px; background: rgba(0, 0, 0, 0.85); color: #ccc; font-size: 0.9em; padding: 1em; border-radius: 1em; text-align: left; z-index: 10; }}
+            .movie:hover .plot-overlay {{ display: block; }} 
+            .meta {{ font-size: 0.9em; color: #ccc; margin-top: 0.5em; }}
+            .flag {{
+                position: absolute;
+                top: 5px;
+                right: 5px;
+                width: 24px;
+                height: 24px;
+                background-size: cover;
+                color: white;
+                font-size: 18px;
+                text-shadow: 0 0 4px black;
+            }}
+            video {{
+                width: 100%;
+                max-height: 60vh;
+                margin-top: 2vw;
+                border-radius: 1em;
+                box-shadow: 0 0 15px #000;
+            }}
+            #scrubber {{ display: none; position: relative; margin-top: 0.5em; }}
+            #scrub {{ width: 100%; }}
+            #thumb {{
+                display: none;
+                position: absolute;
+                bottom: 30px;
+                border-radius: 0.3em;
+                box-shadow: 0 0 10px #000;
+                background-repeat: no-repeat;
+                pointer-events: none;
+            }}
+        </style>
+    </head>
+    <body>
+        <h1>Stream for my love</h1>
+        <video id="player" controls playsinline preload="metadata" crossorigin="anonymous"></video>
+        <div id="scrubber"><div id="thumb"></div><input type="range" id="scrub" min="0" max="0" value="0" step="1"></div>
+        {tv_row}
+        {standard_rows}
+	{survivor_row}
+        <script>
+            const statuses = {{}};
+            const pollingInterval = 15000;
+            let sessionTimer = null;
+
+            function startSession(path) {{
+                // Keeps the asset pinned in the server's cache while it is loaded, playing or paused,
+                // and reports the position for resuming later
+                clearInterval(sessionTimer);
+                const video = document.getElementById("player");
+                // Until the new title's metadata is in, the element still describes the previous one
+                let loaded = false;
+                video.addEventListener('loadedmetadata', () => loaded = true, {{ once: true }});
+                const beat = () => fetch(loaded
+                    ? `/hls_session?file=${{path}}&t=${{video.currentTime}}&d=${{isFinite(video.duration) ? video.duration : 0}}`
+                    : `/hls_session?file=${{path}}`);
+                beat();
+                sessionTimer = setInterval(beat, 30000);
+                video.onpause = beat;
+                video.onended = () => {{
+                    clearInterval(sessionTimer);
+                    beat();
+                }};
+            }}
+
+            function formatTime(seconds) {{
+                seconds = Math.floor(seconds);
+                return `${{Math.floor(seconds / 60)}}:${{(seconds % 60).toString().padStart(2, '0')}}`;
+            }}
+
+            let thumbCues = [];
+            let scrubbing = false;
+
+            function parseThumbs(text) {{
+                const seconds = t => t.split(':').reduce((total, part) => total * 60 + parseFloat(part), 0);
+                return text.split(/\\n\\n+/).map(block => {{
+                    const m = block.match(/([\\d:.]+) --> ([\\d:.]+)\\n(\\S+)#xywh=(\\d+),(\\d+),(\\d+),(\\d+)/);
+                    return m && {{ start: seconds(m[1]), end: seconds(m[2]), url: m[3], x: +m[4], y: +m[5], w: +m[6], h: +m[7] }};
+                }}).filter(Boolean);
+            }}
+
+            function showThumb(time) {{
+                const thumb = document.getElementById('thumb');
+                const cue = thumbCues.find(c => time >= c.start && time < c.end);
+                if (!cue) {{
+                    thumb.style.display = 'none';
+                    return;
+                }}
+                const scrub = document.getElementById('scrub');
+                Object.assign(thumb.style, {{
+                    display: 'block', width: `${{cue.w}}px`, height: `${{cue.h}}px`,
+                    backgroundImage: `url('${{cue.url}}')`, backgroundPosition: `-${{cue.x}}px -${{cue.y}}px`,
+                    left: `calc(${{time / (scrub.max || 1) * 100}}% - ${{cue.w / 2}}px)`
+                }});
+            }}
+
+            function setupScrubber(path) {{
+                // Dragging only previews from the thumbnail sprites; the player seeks once, on release
+                const video = document.getElementById("player");
+                const scrub = document.getElementById('scrub');
+                thumbCues = [];
+                fetch(`/hls/thumbs.vtt?file=${{path}}`)
+                    .then(r => r.ok ? r.text() : '')
+                    .then(text => thumbCues = parseThumbs(text));
+                document.getElementById('scrubber').style.display = 'block';
+                video.ondurationchange = () => scrub.max = Math.floor(isFinite(video.duration) ? video.duration : 0);
+                video.ontimeupdate = () => {{
+                    if (!scrubbing) scrub.value = Math.floor(video.currentTime);
+                }};
+                scrub.oninput = () => {{
+                    scrubbing = true;
+                    showThumb(+scrub.value);
+                }};
+                scrub.onchange = () => {{
+                    scrubbing = false;
+                    document.getElementById('thumb').style.display = 'none';
+                    video.currentTime = +scrub.value;
+                }};
+            }}
+
+            const tiles = {{}};
+            const progress = {{}};
+            let libraryRun = '';
+            let libraryVersion = 0;
+            let pollTimer = null;
+
+            function applyStatus(el, path, data) {{
+                const flag = el.querySelector('.flag');
+                if (data.ready) {{
+                    statuses[path] = 'ready';
+                    flag.textContent = '';
+                    flag.style.backgroundImage = "url('/green-flag.png')";
+                }} else if (data.error && statuses[path] === 'queued') {{
+                    statuses[path] = null;
+                    flag.style.backgroundImage = '';
+                    flag.textContent = '✖';
+                    el.title = data.error;
+                }} else if (statuses[path] === 'ready') {{
+                    // Evicted from the cache since we last looked
+                    statuses[path] = null;
+                    flag.style.backgroundImage = '';
+                }}
+            }}
+
+            function pollLibrary() {{
+                // One request for the whole page; after the first, only titles that changed come back
+                fetch(`/hls_library?since=${{libraryVersion}}&run=${{libraryRun}}`)
+                    .then(r => r.json())
+                    .then(data => {{
+                        libraryRun = data.run;
+                        libraryVersion = data.version;
+                        Object.entries(data.statuses).forEach(([file, status]) => {{
+                            (tiles[file] || []).forEach(el => applyStatus(el, el.dataset.path, status));
+                        }});
+                    }});
+            }}
+
+            function handleClick(el) {{
+                const path = el.dataset.path;
+                const flag = el.querySelector('.flag');
+                flag.textContent = '';
+                const status = statuses[path];
+                const video = document.getElementById("player");
+
+                if (status === 'ready') {{
+                    const url = `/hls/master.m3u8?file=${{path}}`;
+                    fetch(`/hls_resume?file=${{path}}`)
+                        .then(r => r.json())
+                        .catch(() => ({{ position: 0 }}))
+                        .then(data => {{
+                            const offset = data.position && confirm(`Resume from ${{formatTime(data.position)}}?`) ? data.position : 0;
+                            startSession(path);
+                            setupScrubber(path);
+                            if (Hls.isSupported()) {{
+                                // hls.js starts fetching at the resume point rather than loading from 0 and seeking
+                                const hls = new Hls({{ startPosition: offset }});
+                                hls.loadSource(url);
+                                hls.attachMedia(video);
+                                hls.on(Hls.Events.MANIFEST_PARSED, () => video.play());
+                            }} else {{
+                                video.src = url;
+                                video.onloadedmetadata = () => {{
+                                    if (offset) video.currentTime = offset;
+                                    video.play();
+                                }};
+                            }}
+                        }});
+                }} else if (!status) {{
+                    fetch(`/hls_status?file=${{path}}`)
+                        .then(res => res.json())
+                        .then(data => {{
+                            if (data.ready) {{
+                                statuses[path] = 'ready';
+                                flag.textContent = '';
+                                flag.style.backgroundImage = "url('/green-flag.png')";
+                                return;
+                            }}
+                            statuses[path] = 'queued';
+                            flag.style.backgroundImage = "url('/purple-flag.png')";
+                            fetch(`/hls/playlist.m3u8?file=${{path}}`);
+                            let dotCount = 0;
+                            const dots = [".", "..", "..."];
+                            const interval = setInterval(() => {{
+                                if (statuses[path] !== 'queued') return clearInterval(interval);
+                                flag.style.backgroundImage = "url('/purple-flag.png')";
+                                flag.textContent = progress[decodeURIComponent(path)] !== undefined
+                                    ? `${{progress[decodeURIComponent(path)]}}%`
+                                    : dots[dotCount++ % dots.length];
+                            }}, 500);
+                        }});
+                }}
+            }}
+
+            window.onload = () => {{
+                document.querySelectorAll('.movie').forEach(el => {{
+                    const path = el.dataset.path;
+                    statuses[path] = null;
+                    const file = decodeURIComponent(path);
+                    (tiles[file] = tiles[file] || []).push(el);
+                }});
+                pollLibrary();
+                if (!window.EventSource) {{
+                    pollTimer = setInterval(pollLibrary, pollingInterval);
+                    return;
+                }}
+                // Pushed updates replace polling; fall back to it only if the stream is gone for good
+                const events = new EventSource('/events');
+                events.addEventListener('hls', e => {{
+                    const data = JSON.parse(e.data);
+                    // A restarted server: its changes are counted from a fresh start, so catch up in full
+                    if (data.run !== libraryRun) return pollLibrary();
+                    libraryVersion = data.version;
+                    Object.entries(data.statuses).forEach(([file, status]) => {{
+                        (tiles[file] || []).forEach(el => applyStatus(el, el.dataset.path, status));
+                    }});
+                }});
+                events.addEventListener('progress', e => Object.assign(progress, JSON.parse(e.data)));
+                events.addEventListener('library', () => {{
+                    // Rebuild the rows for new titles, but never take a loaded (even paused) title away
+                    if (!document.getElementById("player").currentSrc) location.reload();
+                }});
+                events.onopen = () => pollLibrary();
+                events.onerror = () => {{
+                    if (events.readyState === EventSource.CLOSED && !pollTimer) {{
+                        pollTimer = setInterval(pollLibrary, pollingInterval);
+                    }}
+                }};
+            }};
+        </script>
+        <div style="position: fixed; bottom: 20px; right: 20px;">
+		  <a href="http://100.107.223.221:8000/" title="Cast to TV">
+    		<svg xmlns="http://www.w3.org/2000/svg" height="36" width="36" viewBox="0 0 24 24" fill="#ccc">
+      		<path d="M1 18v3h3c0-1.66-1.34-3-3-3zm0-3v2c2.76 0 5 2.24 5 5h2c0-3.86-3.14-7-7-7zm0-3v2c4.97 0 9 4.03 9 9h2c0-6.08-4.93-11-11-11zM21 3H3c-1.1 0-2 .9-2 2v4h2V5h18v14h-8v2h8c1.1 0 2-.9 2-2V5c0-1.1-.9-2-2-2z"/>
+    		</svg>
+  		</a>
+	   </div>
+    </body>
+    </html>
+    """
+
+def serve(port, handler=HLSHandler):
+    os.makedirs(HLS_LOCK_DIR, exist_ok=True)
+    if HLS_HOT_TIER:
+        os.makedirs(HLS_HOT_DIR, exist_ok=True)
+    remove_legacy_hls_dirs()
+    reconcile_hls_cache()
+    load_watch_history()
+    sync_positions()
+    load_metadata()
+    load_probe_index()
+    threading.Thread(target=index_library, daemon=True).start()
+    threading.Thread(target=probe_index_saver, daemon=True).start()
+    threading.Thread(target=cleanup_old_hls, daemon=True).start()
+    threading.Thread(target=hls_event_producer, daemon=True).start()
+    threading.Thread(target=library_watcher, daemon=True).start()
+    if HLS_ABR:
+        threading.Thread(target=abr_worker, daemon=True).start()
+    if TRICKPLAY_ENABLED and HLS_MODE == "remux":
+        threading.Thread(target=trickplay_worker, daemon=True).start()
+    if PREFETCH_ENABLED and HLS_MODE == "remux":
+        threading.Thread(target=prefetch_worker, daemon=True).start()
+    os.chdir(APP_ROOT)
+    print(f"🎬 Serving on http://0.0.0.0:{port}/")
+    ThreadingHTTPServer(("0.0.0.0", port), handler).serve_forever()
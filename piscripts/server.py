@@ -1,5 +1,5 @@
 
-from http.server import HTTPServer, SimpleHTTPRequestHandler
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
 import os
 import re
 import urllib.parse
@@ -7,29 +7,79 @@ import requests
 import subprocess
 import json
 import threading
+import queue
+import time
+import shutil
+import hashlib
+import socket
+import mimetypes
+from uuid import UUID
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 import pychromecast
+import hls_core
 
 # === CONFIG ===
 APP_ROOT = os.path.dirname(os.path.abspath(__file__))
 MEDIA_DIR = os.path.join(APP_ROOT, "media")
 CACHE_FILE = os.path.join(APP_ROOT, "metadata_cache.json")
+PROBE_INDEX_FILE = os.path.join(APP_ROOT, "probe_index.json")  # written by the HLS servers
+HLS_STORE_DIR = os.path.join(APP_ROOT, "hls_store")  # as are the thumbnail sprites for seek previews
 PI_IP = "0.0.0.0"  # Replace with LAN IP if needed
 PORT = 8000
-CHROMECAST_NAME = "Living Room TV"
+CHROMECAST_NAME = "Living Room TV"  # the device pages control when none is picked
 CHROMECAST_IP = "192.168.68.57"
+CAST_CACHE_FILE = os.path.join(APP_ROOT, "chromecast_cache.json")  # host, port and UUID from the last discovery
 OMDB_API_KEY = "98eb08a4"
 VIDEO_EXTENSIONS = (".mp4", ".mkv", ".avi", ".m4v")
-CATT_PATH = "/home/duncan/.local/bin/catt"
+THUMB_DIR = os.path.join(APP_ROOT, "thumbnails")  # frame grabs for titles without an OMDb poster
+THUMB_WIDTH = 320
+THUMB_WORKERS = 2
+THUMB_RETRY_SECONDS = 600  # a failed grab is not retried until this long after it failed
+MEDIA_HOST = None  # address the Chromecasts fetch /media from; found from the route to each device when unset
+POSITION_SAVE_SECONDS = 30
 
 last_known_duration = {"value": 0}
 movie_metadata = defaultdict(dict)
 metadata_cache = {}
-autoplay_enabled = False
-last_cast = {"folder": None, "file": None}
+probe_index = {"mtime": 0, "entries": {}}
 
-chromecast = None
-media_controller = None
+# Connection managers: one thread per Chromecast owns its connection and reconnects with backoff, while the
+# media status listener keeps the latest state so requests never wait on a round-trip to the device
+RECONNECT_MIN_SECONDS = 1
+RECONNECT_MAX_SECONDS = 60
+RECONNECT_GRACE_SECONDS = 15  # pychromecast retries a lost socket itself for a while
+CONNECT_WAIT_SECONDS = 5
+DISCOVERY_SECONDS = 600
+DISCOVERY_TIMEOUT = 10
+cast_devices = {}
+cast_devices_lock = threading.Lock()
+status_changed = threading.Event()
+
+# Controls are queued per device and applied by its own thread: a burst collapses to its final effect
+# (the last seek target, the resulting play/pause state) and pages get the expected state at once
+COMMAND_DEBOUNCE_SECONDS = 0.3
+COMMAND_SETTLE_SECONDS = 3  # how long the expected state stands in for a status the receiver hasn't sent
+
+# Autoplay follows the media status: the next episode is queued on the receiver while the current one plays
+AUTOPLAY_GRACE_SECONDS = 5  # time the receiver gets to move onto the queued item by itself
+autoplay_events = queue.Queue()
+
+# One producer reads the Chromecast and pushes its state to every open page over /events
+EVENT_KEEPALIVE_SECONDS = 15
+STATUS_PUSH_SECONDS = 1
+event_clients = []
+event_clients_lock = threading.Lock()
+
+# Resume points go through the HLS servers' store, so the player and the TV share them
+hls_core.WATCH_POSITIONS_FILE = os.path.join(APP_ROOT, "watch_positions.json")
+# and casts mark the box busy, so the HLS servers pause their idle-time pre-generation meanwhile
+hls_core.CAST_ACTIVITY_FILE = os.path.join(APP_ROOT, "cast_activity")
+
+thumb_pool = ThreadPoolExecutor(max_workers=THUMB_WORKERS)
+thumb_jobs = {}  # grabs in flight, by output path
+thumb_failures = {}  # output path -> when its last grab failed
+thumb_lock = threading.Lock()
 
 
 def clean_title(filename):
@@ -90,46 +140,588 @@ def load_metadata():
     with open(CACHE_FILE, "w") as f:
         json.dump(metadata_cache, f, indent=2)
 
-def connect_chromecast():
-    global chromecast, media_controller, last_chromecast_failure
+def probed_entry(folder, file):
+    if not file:
+        return {}
+    try:
+        mtime = os.path.getmtime(PROBE_INDEX_FILE)
+        if mtime != probe_index["mtime"]:
+            with open(PROBE_INDEX_FILE, "r") as f:
+                probe_index["entries"] = json.load(f)
+            probe_index["mtime"] = mtime
+    except (OSError, ValueError):
+        return {}
+    return probe_index["entries"].get(os.path.normpath(os.path.join(folder or "", file)), {})
+
+
+def probed_duration(folder, file):
+    # Duration from the shared ffprobe index, so the slider works before the Chromecast reports one
+    return probed_entry(folder, file).get("duration", 0)
+
+
+def thumbnail_path(rel_path):
+    # Keyed by path, size and mtime so a replaced file gets a fresh grab
+    st = os.stat(os.path.join(MEDIA_DIR, rel_path))
+    key = hashlib.sha1(f"{rel_path}:{st.st_size}:{int(st.st_mtime)}".encode()).hexdigest()[:16]
+    return os.path.join(THUMB_DIR, key + ".jpg")
+
+
+def grab_thumbnail(rel_path, out_path):
+    # ffmpeg's thumbnail filter picks the most representative of ~100 frames, a tenth of the way in
+    ffmpeg = shutil.which("ffmpeg") or "/usr/bin/ffmpeg"
+    duration = probed_duration(os.path.dirname(rel_path), os.path.basename(rel_path))
+    tmp_path = out_path + ".tmp.jpg"
+    for start in (duration * 0.1 if duration else 60, 0):
+        cmd = [
+            "nice", "-n", "19", ffmpeg, "-nostdin", "-v", "error", "-ss", str(int(start)),
+            "-i", os.path.join(MEDIA_DIR, rel_path), "-an", "-sn",
+            "-vf", f"thumbnail,scale={THUMB_WIDTH}:-2", "-frames:v", "1", "-q:v", "4", "-y", tmp_path
+        ]
+        try:
+            subprocess.run(cmd, check=True, capture_output=True, timeout=120)
+        except (OSError, subprocess.SubprocessError):
+            continue
+        if os.path.exists(tmp_path):
+            os.replace(tmp_path, out_path)
+            return out_path
+    print(f"Thumbnail failed for {rel_path}")
+    return None
+
+
+def thumbnail_done(out_path, job):
+    with thumb_lock:
+        if thumb_jobs.get(out_path) is job:
+            del thumb_jobs[out_path]
+        if job.exception() is None and job.result():
+            thumb_failures.pop(out_path, None)
+        else:
+            thumb_failures[out_path] = time.time()
+
+
+def queue_thumbnail(rel_path):
+    # At most THUMB_WORKERS grabs run at once; a request for one in flight waits on the same future.
+    # Finished jobs drop out of thumb_jobs, and a failed grab is retried after THUMB_RETRY_SECONDS.
+    out_path = thumbnail_path(rel_path)
+    with thumb_lock:
+        job = thumb_jobs.get(out_path)
+        if job is not None:
+            return job
+        if os.path.exists(out_path) or time.time() - thumb_failures.get(out_path, 0) < THUMB_RETRY_SECONDS:
+            return None
+        job = thumb_jobs[out_path] = thumb_pool.submit(grab_thumbnail, rel_path, out_path)
+    # Outside the lock: a job that has already finished runs its callback right here
+    job.add_done_callback(lambda done: thumbnail_done(out_path, done))
+    return job
+
+
+def queue_missing_thumbnails():
+    os.makedirs(THUMB_DIR, exist_ok=True)
+    for folder, movies in list(movie_metadata.items()):
+        for filename, meta in list(movies.items()):
+            if folder == "survivor" or meta.get("Poster") == "N/A":
+                try:
+                    queue_thumbnail(os.path.normpath(os.path.join(folder, filename)))
+                except OSError:
+                    pass
+
 
-    if chromecast and hasattr(chromecast, "media_controller"):
-        return  # Already connected and valid
+def thumbs_url(folder, file):
+    # Sprite track the HLS servers built for this title, if it has been packaged there
+    asset = probed_entry(folder, file).get("asset")
+    if asset and os.path.exists(os.path.join(HLS_STORE_DIR, asset, "thumbs.vtt")):
+        return f"/hls_store/{asset}/thumbs.vtt"
+    return None
+
+
+class CastDevice:
+    # One per Chromecast: its connection, the latest media status and what this server last cast to it
+    def __init__(self, name, host=None):
+        self.name = name
+        self.host = host  # configured address, tried when nothing is cached
+        self.cast = None
+        self.controller = None
+        self.status = None
+        self.updated = 0
+        self.last_failure = None
+        self.last_cast = {"folder": None, "file": None}
+        self.autoplay = False
+        self.queued = None  # next item inserted into the receiver's queue
+        self.queued_item_id = None  # its itemId on the receiver, once the insert is answered
+        self.preloaded_for = None
+        self.finished = None
+        self.commands = {}
+        self.expected = {}
+        self.applied_at = 0
+        self.commands_ready = threading.Event()
+        self.commands_lock = threading.Lock()
+        self.connected = threading.Event()
+        self.lost = threading.Event()
+        self.wake = threading.Event()
+        self.lock = threading.Lock()
+
+
+class CastListener:
+    # Called from pychromecast's socket thread
+    def __init__(self, device):
+        self.device = device
+
+    def new_media_status(self, status):
+        self.device.status = status
+        self.device.updated = time.time()
+        sample_position(self.device)
+        status_changed.set()
+        autoplay_events.put(self.device)
 
+    def new_connection_status(self, status):
+        if status.status == "CONNECTED":
+            self.device.connected.set()
+        elif status.status in ("LOST", "FAILED", "DISCONNECTED"):
+            self.device.connected.clear()
+            self.device.lost.set()
+        status_changed.set()
+
+
+def load_cast_cache():
     try:
-        print(f"🔍 Discovering Chromecast named '{CHROMECAST_NAME}'...")
-        chromecasts, browser = pychromecast.get_listed_chromecasts(friendly_names=[CHROMECAST_NAME])
-        if not chromecasts:
-            raise Exception(f"Chromecast '{CHROMECAST_NAME}' not found.")
-
-        chromecast = chromecasts[0]
-        chromecast.wait()
-        media_controller = chromecast.media_controller
-        last_chromecast_failure = None
-        print(f"✅ Connected to {CHROMECAST_NAME}")
-    except Exception as e:
-        chromecast = None
-        media_controller = None
-        last_chromecast_failure = str(e)
-        print(f"❌ Connection failed: {e}")
-        raise
+        with open(CAST_CACHE_FILE, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
 
 
-def schedule_next_episode(folder, current_file):
-    if not autoplay_enabled:
+def save_cast_cache(infos):
+    cache = load_cast_cache()
+    updated = dict(cache)
+    for info in infos:
+        updated[info.friendly_name] = {"host": info.host, "port": info.port,
+                                       "uuid": str(info.uuid) if info.uuid else None,
+                                       "model_name": info.model_name}
+    if updated == cache:
         return
-    file_list = sorted(movie_metadata.get(folder, {}).keys())
+    tmp_path = CAST_CACHE_FILE + ".tmp"
     try:
-        idx = file_list.index(current_file)
-        next_file = file_list[idx + 1]
+        with open(tmp_path, "w") as f:
+            json.dump(updated, f, indent=2)
+        os.replace(tmp_path, CAST_CACHE_FILE)
+    except OSError as e:
+        print("Could not save Chromecast cache:", e)
+
+
+def cast_from_host(name, known):
+    # Straight to a known address: one connection attempt, no mDNS
+    uuid = known.get("uuid")
+    cast = pychromecast.get_chromecast_from_host(
+        (known["host"], known.get("port") or 8009, UUID(uuid) if uuid else None, known.get("model_name"), name),
+        tries=1, timeout=CONNECT_WAIT_SECONDS,
+    )
+    cast.wait(timeout=CONNECT_WAIT_SECONDS)
+    if cast.socket_client.is_connected:
+        return cast
+    cast.disconnect(blocking=False)
+    return None
+
+
+def find_chromecast(device):
+    # The cached address, then the configured one, and only then a discovery run
+    candidates = []
+    cached = load_cast_cache().get(device.name)
+    if cached:
+        candidates.append(cached)
+    if device.host and not (cached and cached.get("host") == device.host):
+        candidates.append({"host": device.host})
+    for known in candidates:
+        try:
+            cast = cast_from_host(device.name, known)
+        except Exception as e:
+            print(f"Direct connect to {known['host']} failed: {e}")
+            continue
+        if cast:
+            return cast
+
+    print(f"🔍 Discovering Chromecast named '{device.name}'...")
+    chromecasts, browser = pychromecast.get_listed_chromecasts(friendly_names=[device.name])
+    # A discovered cast resolves its address through the browser's zeroconf on every (re)connect, so it
+    # cannot outlive the browser; connect by the resolved host instead and let the browser go
+    info = chromecasts[0].cast_info if chromecasts else None
+    browser.stop_discovery()
+    if not info or not info.host:
+        raise Exception(f"Chromecast '{device.name}' not found.")
+    cast = cast_from_host(device.name, {"host": info.host, "port": info.port,
+                                        "uuid": str(info.uuid) if info.uuid else None,
+                                        "model_name": info.model_name})
+    if not cast:
+        raise Exception(f"Chromecast '{device.name}' found at {info.host} but did not answer.")
+    return cast
+
+
+def connect_chromecast(device):
+    with device.lock:
+        if device.cast and hasattr(device.cast, "media_controller"):
+            return  # Already connected and valid
+
+        try:
+            device.cast = find_chromecast(device)
+            listener = CastListener(device)
+            device.cast.register_connection_listener(listener)
+            if not device.cast.socket_client.is_connected:
+                raise Exception(f"Chromecast '{device.name}' did not answer.")
+            save_cast_cache([device.cast.cast_info])
+            device.controller = device.cast.media_controller
+            device.controller.register_status_listener(listener)
+            device.controller.update_status()
+            device.connected.set()
+            device.last_failure = None
+            print(f"✅ Connected to {device.name}")
+        except Exception as e:
+            if device.cast:
+                device.cast.disconnect(blocking=False)
+            device.cast = None
+            device.controller = None
+            device.last_failure = str(e)
+            print(f"❌ Connection to {device.name} failed: {e}")
+            raise
+
+
+def drop_chromecast(device):
+    with device.lock:
+        device.connected.clear()
+        device.status = None
+        if device.cast:
+            try:
+                device.cast.disconnect(blocking=False)
+            except Exception as e:
+                print("Disconnect failed:", e)
+        device.cast = None
+        device.controller = None
+    status_changed.set()
+
+
+def connection_manager(device):
+    delay = RECONNECT_MIN_SECONDS
+    while True:
+        if not device.cast:
+            try:
+                connect_chromecast(device)
+                delay = RECONNECT_MIN_SECONDS
+            except Exception:
+                # A request wanting the device cuts the backoff short
+                device.wake.wait(delay)
+                device.wake.clear()
+                delay = min(delay * 2, RECONNECT_MAX_SECONDS)
+                continue
+        device.lost.wait()
+        device.lost.clear()
+        if not device.connected.wait(RECONNECT_GRACE_SECONDS):
+            print(f"🔌 Connection to {device.name} lost, reconnecting")
+            drop_chromecast(device)
+
+
+def add_device(name, host=None):
+    with cast_devices_lock:
+        device = cast_devices.get(name)
+        if device is None:
+            device = cast_devices[name] = CastDevice(name, host)
+            threading.Thread(target=connection_manager, args=(device,), daemon=True).start()
+            threading.Thread(target=command_worker, args=(device,), daemon=True).start()
+    return device
+
+
+def device_discovery():
+    # Every video Chromecast on the network gets a device and a manager; audio devices and groups are left out
+    while True:
+        try:
+            infos, browser = pychromecast.discovery.discover_chromecasts(timeout=DISCOVERY_TIMEOUT)
+            browser.stop_discovery()
+            infos = [info for info in infos if info.cast_type in (None, "cast") and info.friendly_name]
+            save_cast_cache(infos)
+            for info in infos:
+                if info.friendly_name not in cast_devices:
+                    print(f"📺 Found {info.friendly_name} at {info.host}")
+                    add_device(info.friendly_name)
+        except Exception as e:
+            print("Discovery failed:", e)
+        time.sleep(DISCOVERY_SECONDS)
+
+
+def require_chromecast(device):
+    # Requests never discover on their own; they wait briefly for the manager's connection
+    if not device.connected.is_set():
+        device.wake.set()
+        if not device.connected.wait(CONNECT_WAIT_SECONDS):
+            raise Exception(f"Chromecast '{device.name}' is not connected ({device.last_failure})")
+    return device.controller
+
+
+def expected_state(device):
+    # What the device will report once queued commands land; empty when the receiver has caught up
+    if device.commands or (device.updated <= device.applied_at
+                           and time.time() - device.applied_at < COMMAND_SETTLE_SECONDS):
+        return device.expected
+    return {}
+
+
+def queue_command(device, action, value=None):
+    with device.commands_lock:
+        if not expected_state(device):
+            device.expected = {}
+        if action == "stop":
+            device.commands = {"stop": True}
+            device.expected = {"state": "IDLE"}
+        elif action == "playpause":
+            # Each press flips the state the previous press asked for, so an even number cancels out
+            status = device.status
+            state = device.expected.get("state") or (status.player_state if status else None)
+            playing = state in ("PLAYING", "BUFFERING")
+            device.commands["playback"] = "pause" if playing else "play"
+            device.expected["state"] = "PAUSED" if playing else "PLAYING"
+        elif action == "seek":
+            device.commands["seek"] = value
+            device.expected["current_time"] = value
+    device.commands_ready.set()
+    status_changed.set()
+
+
+def command_worker(device):
+    while True:
+        device.commands_ready.wait()
+        time.sleep(COMMAND_DEBOUNCE_SECONDS)  # let the rest of a burst arrive
+        with device.commands_lock:
+            commands = dict(device.commands)
+            device.commands_ready.clear()
+        try:
+            controller = require_chromecast(device)
+            if commands.get("stop"):
+                controller.stop()
+            state = device.status.player_state if device.status else None
+            if commands.get("playback") == "pause" and state in ("PLAYING", "BUFFERING"):
+                controller.pause()
+            elif commands.get("playback") == "play" and state != "PLAYING":
+                controller.play()
+            if "seek" in commands:
+                controller.seek(commands["seek"])
+        except Exception as e:
+            print(f"Command on {device.name} failed:", e)
+        with device.commands_lock:
+            # Anything queued meanwhile stays for the next round
+            for key, value in commands.items():
+                if device.commands.get(key) == value:
+                    del device.commands[key]
+            device.applied_at = time.time()
+        status_changed.set()
+
+
+def current_status(device):
+    status = device.status
+    if not device.connected.is_set() or status is None:
+        return {"current_time": 0, "duration": 0, "state": "OFFLINE"}
+    # The receiver only reports on changes; the position in between is extrapolated from the last report
+    position = getattr(status, "adjusted_current_time", None)
+    last_cast = device.last_cast
+    current = {
+        "current_time": round(position if position is not None else status.current_time or 0, 1),
+        "duration": status.duration or probed_duration(last_cast["folder"], last_cast["file"]),
+        "state": status.player_state or "UNKNOWN",
+        "thumbs": thumbs_url(last_cast["folder"], last_cast["file"])
+    }
+    current.update(expected_state(device))
+    return current
+
+
+def sample_position(device):
+    status = device.status
+    if status is None:
+        return
+    rel_path = media_path(status.content_id)
+    if status.player_state in ("PLAYING", "PAUSED"):
+        position = getattr(status, "adjusted_current_time", None)
+        if position is None:
+            position = status.current_time or 0
+        hls_core.record_position(rel_path, position, status.duration)
+    elif status.player_state == "IDLE" and status.idle_reason == "FINISHED":
+        duration = status.duration or probed_duration(*os.path.split(rel_path or ""))
+        hls_core.record_position(rel_path, 0, duration, completed=True)
+
+
+def position_writer():
+    # The receiver only reports on changes, so a steady stretch of playback is sampled here
+    while True:
+        time.sleep(POSITION_SAVE_SECONDS)
+        playing = False
+        for device in list(cast_devices.values()):
+            if device.connected.is_set():
+                sample_position(device)
+                playing = playing or bool(device.status and device.status.player_state in ("PLAYING", "BUFFERING"))
+        if playing:
+            hls_core.mark_cast_activity()
+        hls_core.sync_positions()
+
+
+def status_message(device):
+    return f"data: {json.dumps(current_status(device))}\n\n".encode()
+
+
+def status_producer():
+    last = {}
+    while True:
+        status_changed.wait(STATUS_PUSH_SECONDS)
+        status_changed.clear()
+        with event_clients_lock:
+            clients = list(event_clients)
+        if not clients:
+            last = {}
+            continue
+        messages = {}
+        for device, client in clients:
+            if device.name not in messages:
+                message = status_message(device)
+                messages[device.name] = message if message != last.get(device.name) else None
+                last[device.name] = message
+            if messages[device.name]:
+                client.put(messages[device.name])
+
+
+def media_url(device, rel_path):
+    host = MEDIA_HOST
+    if not host:
+        # The interface that routes to the Chromecast is the one it can reach us on
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as probe:
+            probe.connect((device.cast.cast_info.host, 8009))
+            host = probe.getsockname()[0]
+    return f"http://{host}:{PORT}/media/{urllib.parse.quote(rel_path)}"
+
+
+def cast_file(device, folder, file, start=0, autoplay=True):
+    # A LOAD straight to the receiver: it replaces whatever is playing and fetches /media with byte ranges.
+    # A resume point goes in the same LOAD, so playback starts there instead of seeking after the fact.
+    controller = require_chromecast(device)
+    rel_path = os.path.normpath(os.path.join(folder, file))
+    content_type = mimetypes.guess_type(file)[0] or "video/mp4"
+    controller.play_media(media_url(device, rel_path), content_type, title=clean_title(file),
+                          current_time=start or None, autoplay=autoplay)
+    device.last_cast["folder"] = folder
+    device.last_cast["file"] = file
+    # A LOAD replaces the receiver's queue along with the item
+    device.queued = device.queued_item_id = device.preloaded_for = device.finished = None
+
+
+def natural_key(s):
+    return [int(text) if text.isdigit() else text.lower() for text in re.split(r"(\d+)", s)]
+
+
+def video_files(folder):
+    try:
+        return sorted((f for f in os.listdir(folder) if f.lower().endswith(VIDEO_EXTENSIONS)), key=natural_key)
+    except OSError:
+        return []
+
+
+def next_episode(rel_path):
+    # TV.py's order: episodes naturally sorted within a season, then on into the next season
+    parts = rel_path.split(os.sep)
+    if len(parts) == 4 and parts[0] == "TV":
+        show_path = os.path.join(MEDIA_DIR, "TV", parts[1])
+        try:
+            seasons = sorted((d for d in os.listdir(show_path) if os.path.isdir(os.path.join(show_path, d))),
+                             key=natural_key)
+        except OSError:
+            return None
+        playlist = [os.path.join("TV", parts[1], season, episode)
+                    for season in seasons for episode in video_files(os.path.join(show_path, season))]
+    else:
+        folder = os.path.dirname(rel_path)
+        playlist = [os.path.join(folder, f) for f in video_files(os.path.join(MEDIA_DIR, folder))]
+    try:
+        return playlist[playlist.index(rel_path) + 1]
     except (ValueError, IndexError):
+        return None
+
+
+def media_path(content_id):
+    # Library path of something this server cast, None for anything else on the receiver
+    path = urllib.parse.urlparse(content_id or "").path
+    if not path.startswith("/media/"):
+        return None
+    return urllib.parse.unquote(path[len("/media/"):])
+
+
+def advance_queue(device):
+    status = device.status
+    if not device.autoplay or status is None or not device.connected.is_set():
+        return
+    playing = media_path(status.content_id)
+    if playing and playing == device.queued:
+        # The receiver moved onto the queued item by itself
+        device.last_cast["folder"], device.last_cast["file"] = os.path.split(playing)
+        device.queued = device.queued_item_id = device.preloaded_for = device.finished = None
+    last_cast = device.last_cast
+    if not last_cast["file"] or playing != os.path.normpath(os.path.join(last_cast["folder"], last_cast["file"])):
+        return  # something else is on the TV
+
+    if status.player_state in ("PLAYING", "BUFFERING", "PAUSED"):
+        device.finished = None
+        if device.preloaded_for != playing:
+            next_path = next_episode(playing)
+            if next_path:
+                # QUEUE_INSERT behind the current item, so the receiver starts it without a fresh LOAD
+                url = media_url(device, next_path)
+                device.queued, device.queued_item_id = next_path, None
+                device.controller.play_media(url, mimetypes.guess_type(next_path)[0] or "video/mp4",
+                                             title=clean_title(os.path.basename(next_path)), enqueue=True,
+                                             callback_function=lambda *args: note_queued_item(device, url, args[-1]))
+                print(f"⏭️ Queued {next_path} on {device.name}")
+            # Only once the insert went through; a failed one is tried again on the next status
+            device.preloaded_for = playing
+    elif status.player_state == "IDLE" and status.idle_reason == "FINISHED":
+        if device.finished is None:
+            device.finished = time.time()
+        if device.queued and time.time() - device.finished < AUTOPLAY_GRACE_SECONDS:
+            return
+        # Nothing queued, or the receiver never picked it up: load the next item outright
+        next_path = device.queued or next_episode(playing)
+        if next_path:
+            cast_file(device, *os.path.split(next_path))
+
+
+def note_queued_item(device, url, response):
+    # The receiver answers a QUEUE_INSERT with a media status listing its queue (pychromecast passes just
+    # that message, or a sent flag before it, depending on the version)
+    if not isinstance(response, dict):
+        return
+    for entry in response.get("status") or []:
+        items = [item for item in entry.get("items") or [] if "itemId" in item]
+        matching = [item for item in items if (item.get("media") or {}).get("contentId") == url]
+        if matching or len(items) > 1:
+            # Items may come without their media; an insert without a position goes to the end of the queue
+            device.queued_item_id = max(item["itemId"] for item in matching or items)
+
+
+def cancel_queued(device):
+    # The receiver moves on to an inserted item by itself, so it is taken out of its queue again
+    status = device.status
+    if not device.queued or status is None or status.media_session_id is None:
+        return
+    if device.queued_item_id is None:
+        print(f"Could not drop {device.name}'s queued next episode: the receiver never reported its item")
         return
-    full_path = os.path.abspath(os.path.join(MEDIA_DIR, folder, next_file))
-    def delayed_cast():
-        subprocess.Popen([CATT_PATH, "--device", CHROMECAST_NAME, "cast", full_path])
-        last_cast["folder"] = folder
-        last_cast["file"] = next_file
-    threading.Timer(20, delayed_cast).start()
+    device.controller.send_message({"type": "QUEUE_REMOVE", "mediaSessionId": status.media_session_id,
+                                    "itemIds": [device.queued_item_id]}, inc_session_id=True)
+    device.queued = device.queued_item_id = device.preloaded_for = None
+    print(f"⏹️ Dropped {device.name}'s queued next episode")
+
+
+def autoplay_manager():
+    # Woken by every media status; the timeout covers the grace period after a FINISHED
+    while True:
+        try:
+            devices = [autoplay_events.get(timeout=AUTOPLAY_GRACE_SECONDS)]
+        except queue.Empty:
+            devices = list(cast_devices.values())
+        for device in devices:
+            try:
+                advance_queue(device)
+            except Exception as e:
+                print(f"Autoplay on {device.name} failed:", e)
+
 
 class BannerHandler(SimpleHTTPRequestHandler):
     def get_head(self, title="Movie Caster"):
@@ -158,24 +750,48 @@ class BannerHandler(SimpleHTTPRequestHandler):
         </head>
         """
 
-    def send_pretty_page(self, title, message):
+    def home_url(self, device):
+        if device.name == CHROMECAST_NAME:
+            return "/"
+        return f"/?device={urllib.parse.quote(device.name)}"
+
+    def get_device(self, params):
+        # Controls act on the device named in the request, the default one otherwise
+        name = params.get("device", [CHROMECAST_NAME])[0]
+        device = cast_devices.get(name)
+        if device is None:
+            self.send_error(404, f"Unknown device: {name}")
+        return device
+
+    def send_pretty_page(self, title, message, device, buttons=None):
+        buttons = buttons or [("Go Back", self.home_url(device))]
+        playpause = f"/playpause?device={urllib.parse.quote(device.name)}"
+        links = "".join(f'<a class="button" href="{href}">{label}</a>' for label, href in buttons)
         html = f"""
         <html>
         {self.get_head(title)}
         <body>
             <h1>{message}</h1>
             <div style="text-align:center;">
-                <a class="button" id="backBtn" href="/">Go Back</a>
+                {links}
             </div>
             <script>
+            const buttons = Array.from(document.querySelectorAll(".button"));
+            let selected = 0;
+            function highlight() {{
+                buttons.forEach((b, i) => b.style.outline = i === selected && buttons.length > 1 ? "3px solid #6cf" : "");
+            }}
+            highlight();
             document.addEventListener("keydown", function(e) {{
                 const key = e.key.toLowerCase();
-                if (key === "enter") {{
-                    const backBtn = document.getElementById("backBtn");
-                if (backBtn) backBtn.click();
+                if (key === "arrowright" || key === "arrowleft") {{
+                    selected = (selected + (key === "arrowright" ? 1 : buttons.length - 1)) % buttons.length;
+                    highlight();
+                }} else if (key === "enter") {{
+                if (buttons[selected]) buttons[selected].click();
                 }} else if (key === "contextmenu") {{
 		e.preventDefault();
-                fetch("/playpause");
+                fetch({json.dumps(playpause)}, {{ redirect: "manual" }});
                 }}
             }});
             </script>
@@ -185,8 +801,79 @@ class BannerHandler(SimpleHTTPRequestHandler):
         self.wfile.write(html.encode())
 
 
+    def send_media_file(self, path):
+        # Byte-range aware so the receiver can seek and read the moov atom at the end of the file
+        try:
+            f = open(path, "rb")
+        except OSError:
+            self.send_error(404)
+            return
+        with f:
+            size = os.fstat(f.fileno()).st_size
+            start, end = 0, size - 1
+            match = re.match(r"bytes=(\d*)-(\d*)$", self.headers.get("Range", ""))
+            if match and (match.group(1) or match.group(2)):
+                if match.group(1):
+                    start = int(match.group(1))
+                    end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+                else:
+                    start = max(0, size - int(match.group(2)))
+                if start > end:
+                    self.send_response(416)
+                    self.send_header("Content-Range", f"bytes */{size}")
+                    self.end_headers()
+                    return
+                self.send_response(206)
+                self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+            else:
+                self.send_response(200)
+            self.send_header("Content-type", mimetypes.guess_type(path)[0] or "video/mp4")
+            self.send_header("Accept-Ranges", "bytes")
+            self.send_header("Access-Control-Allow-Origin", "*")
+            self.send_header("Content-Length", str(end - start + 1))
+            self.end_headers()
+            f.seek(start)
+            remaining = end - start + 1
+            marked = 0
+            try:
+                while remaining > 0:
+                    if time.time() - marked > hls_core.CAST_ACTIVITY_SECONDS / 2:
+                        hls_core.mark_cast_activity()
+                        marked = time.time()
+                    chunk = f.read(min(256 * 1024, remaining))
+                    if not chunk:
+                        break
+                    self.wfile.write(chunk)
+                    remaining -= len(chunk)
+            except OSError:
+                pass  # the receiver drops connections freely while seeking
+
+    def stream_events(self, device):
+        self.send_response(200)
+        self.send_header("Content-type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        client = queue.Queue()
+        # The producer only sends changes, so a new page gets the current state straight away
+        client.put(status_message(device))
+        entry = (device, client)
+        with event_clients_lock:
+            event_clients.append(entry)
+        try:
+            while True:
+                try:
+                    message = client.get(timeout=EVENT_KEEPALIVE_SECONDS)
+                except queue.Empty:
+                    message = b": keepalive\n\n"
+                self.wfile.write(message)
+                self.wfile.flush()
+        except OSError:
+            pass
+        finally:
+            with event_clients_lock:
+                event_clients.remove(entry)
+
     def do_GET(self):
-        global autoplay_enabled
         parsed = urllib.parse.urlparse(self.path)
         params = urllib.parse.parse_qs(parsed.query)
         if parsed.path == "/favicon.ico":
@@ -202,6 +889,10 @@ class BannerHandler(SimpleHTTPRequestHandler):
                 return
 
         if parsed.path == "/":
+            device = self.get_device(params)
+            if not device:
+                return
+            device_query = f"&device={urllib.parse.quote(device.name)}"
             self.send_response(200)
             self.send_header("Content-type", "text/html")
             self.end_headers()
@@ -227,14 +918,15 @@ class BannerHandler(SimpleHTTPRequestHandler):
 
                 banner_items = ""
                 for filename, meta in movies.items():
-                    if meta.get("Poster") == "N/A":
-                        continue
                     rel_path = os.path.join(folder, filename)
-                    plot = meta['Plot'].replace('"', '&quot;')
+                    plot = (meta['Plot'] or "").replace('"', '&quot;')
+                    poster = meta['Poster']
+                    if poster == "N/A":
+                        poster = f"/thumb?file={urllib.parse.quote(rel_path)}"
                     banner_items += f"""
                     <div class="movie">
-                        <a href="/cast?file={urllib.parse.quote(rel_path)}">
-                            <img src="{meta['Poster']}" alt="{meta['Title']}">
+                        <a href="/cast?file={urllib.parse.quote(rel_path)}{device_query}">
+                            <img src="{poster}" alt="{meta['Title']}" loading="lazy">
                         </a>
                         <div class="plot-overlay">{plot}</div>
                         <div class="meta">
@@ -254,8 +946,8 @@ class BannerHandler(SimpleHTTPRequestHandler):
                     clean_name = os.path.splitext(filename)[0]
                     banner_items += f"""
                     <div class="movie">
-                        <a href="/cast?file={urllib.parse.quote(rel_path)}">
-                            <img src="https://plus.unsplash.com/premium_photo-1710409625244-e9ed7e98f67b?fm=jpg&q=60&w=3000&ixlib=rb-4.0.3&ixid=M3wxMjA3fDB8MHxwaG90by1yZWxhdGVkfDF8fHxlbnwwfHx8fHw%3D" alt="{clean_name}">
+                        <a href="/cast?file={urllib.parse.quote(rel_path)}{device_query}">
+                            <img src="/thumb?file={urllib.parse.quote(rel_path)}" alt="{clean_name}" loading="lazy">
                         </a>
                         <div class="meta">
                             <strong>{clean_name}</strong>
@@ -267,8 +959,15 @@ class BannerHandler(SimpleHTTPRequestHandler):
                         f"<h2>Saves</h2><div class='banner'>{banner_items}</div>"
                     )
 
+            devices_html = ""
+            if len(cast_devices) > 1:
+                for name in sorted(cast_devices):
+                    style = " style='background: #6cf;'" if name == device.name else ""
+                    devices_html += f"<a class='button'{style} href='/?device={urllib.parse.quote(name)}'>{name}</a>"
+                devices_html = f"<div style='text-align:center;'>{devices_html}</div>"
+
             toggle_label = (
-                "Autoplay next episode" if autoplay_enabled else "Autoplay is BROKEN"
+                "Autoplay next episode" if device.autoplay else "Autoplay is off"
             )
             keyboard_script = """
             let selectedIndex = 0;
@@ -305,7 +1004,7 @@ document.addEventListener("DOMContentLoaded", () => {
             if (link) link.click();
         } else if (key === "contextmenu") {
 		e.preventDefault();
-            fetch("/playpause");
+            fetch(`/playpause?device=${encodeURIComponent(DEVICE)}`, { redirect: "manual" });
         }
     });
 
@@ -359,7 +1058,9 @@ const sliderContainer = document.createElement("div");
 sliderContainer.id = "slider-container";
 sliderContainer.style.textAlign = "center";
 sliderContainer.style.margin = "2vw";
+sliderContainer.style.position = "relative";
 sliderContainer.innerHTML = `
+    <div id="seekThumb" style="display: none; position: absolute; bottom: 4em; border-radius: 0.3em; box-shadow: 0 0 10px #000; background-repeat: no-repeat; pointer-events: none;"></div>
     <input type="range" id="seekSlider" min="0" max="100" value="0" step="1" style="width: 60%;">
     <div id="timeDisplay" style="margin-top: 0.5em; color: #aaa;">0:00 / 0:00</div>
 `;
@@ -368,7 +1069,6 @@ let slider = document.getElementById("seekSlider");
 let timeDisplay = document.getElementById("timeDisplay");
 let duration = 0;
 let isDragging = false;
-let dragTimeout = null;
 function formatTime(seconds) {
     seconds = Math.floor(seconds || 0);
     const mins = Math.floor(seconds / 60);
@@ -381,38 +1081,81 @@ function updateSlider(currentTime) {
         timeDisplay.innerText = `${formatTime(currentTime)} / ${formatTime(duration)}`;
     }
 }
+let thumbsUrl = null;
+let thumbCues = [];
+function parseThumbs(text) {
+    const seconds = t => t.split(':').reduce((total, part) => total * 60 + parseFloat(part), 0);
+    return text.split(/\\n\\n+/).map(block => {
+        const m = block.match(/([\\d:.]+) --> ([\\d:.]+)\\n(\\S+)#xywh=(\\d+),(\\d+),(\\d+),(\\d+)/);
+        return m && { start: seconds(m[1]), end: seconds(m[2]), url: m[3], x: +m[4], y: +m[5], w: +m[6], h: +m[7] };
+    }).filter(Boolean);
+}
+function showThumb(time) {
+    // Preview from the sprite sheet while dragging; the Chromecast only seeks on release
+    const thumb = document.getElementById("seekThumb");
+    const cue = thumbCues.find(c => time >= c.start && time < c.end);
+    if (!cue) {
+        thumb.style.display = "none";
+        return;
+    }
+    const rect = slider.getBoundingClientRect();
+    const parent = sliderContainer.getBoundingClientRect();
+    const x = rect.left - parent.left + time / (duration || 1) * rect.width;
+    Object.assign(thumb.style, {
+        display: "block", width: `${cue.w}px`, height: `${cue.h}px`, left: `${x - cue.w / 2}px`,
+        backgroundImage: `url('${cue.url}')`, backgroundPosition: `-${cue.x}px -${cue.y}px`
+    });
+}
+function applyStatus(data) {
+    duration = Math.floor(data.duration || 0);
+    slider.max = duration;
+    updateSlider(data.current_time || 0);
+    if ((data.thumbs || null) !== thumbsUrl) {
+        thumbsUrl = data.thumbs || null;
+        thumbCues = [];
+        if (thumbsUrl) {
+            fetch(thumbsUrl).then(r => r.ok ? r.text() : '').then(text => thumbCues = parseThumbs(text));
+        }
+    }
+}
 function pollStatus() {
-    fetch('/status')
+    fetch(`/status?device=${encodeURIComponent(DEVICE)}`)
         .then(response => response.json())
-        .then(data => {
-            duration = Math.floor(data.duration || 0);
-            slider.max = duration;
-            updateSlider(data.current_time || 0);
-        })
+        .then(applyStatus)
         .catch(err => {
             console.warn("Status polling failed:", err);
         });
 }
 slider.addEventListener("input", () => {
     isDragging = true;
-    clearTimeout(dragTimeout);
     timeDisplay.innerText = `${formatTime(slider.value)} / ${formatTime(duration)}`;
+    showThumb(+slider.value);
 });
 
 slider.addEventListener("change", () => {
-    fetch(`/seek?time=${slider.value}`)
-        .then(() => {
-            // give it a short delay before resuming polling updates
-            dragTimeout = setTimeout(() => {
-                isDragging = false;
-            }, 1000);
+    document.getElementById("seekThumb").style.display = "none";
+    fetch(`/seek?time=${slider.value}&device=${encodeURIComponent(DEVICE)}`)
+        .then(response => response.json())
+        .then(data => {
+            // The server answers with where the player is headed, so the slider doesn't jump back meanwhile
+            isDragging = false;
+            applyStatus(data);
         })
         .catch(err => {
             console.error("Seek failed:", err);
             isDragging = false;
         });
 });
-setInterval(pollStatus, 2000);
+// Status is pushed by the server; poll only where EventSource is missing or the stream is gone for good
+if (window.EventSource) {
+    const events = new EventSource(`/events?device=${encodeURIComponent(DEVICE)}`);
+    events.onmessage = e => applyStatus(JSON.parse(e.data));
+    events.onerror = () => {
+        if (events.readyState === EventSource.CLOSED) setInterval(pollStatus, 2000);
+    };
+} else {
+    setInterval(pollStatus, 2000);
+}
 """
 
             html = """
@@ -420,13 +1163,14 @@ setInterval(pollStatus, 2000);
             {head}
             <body>
                 <h1>This is for my love whom I love</h1>
+                {devices}
                 {rows}
                 <div class='toggle'>
-                    <a class='button' href='/toggle_autoplay'>{toggle}</a>
+                    <a class='button' href='/toggle_autoplay?{query}'>{toggle}</a>
                 </div>
                 <div style='text-align:center;'>
-                    <a class='button' href='/stop'>Stop Cast</a>
-                    <a class='button' href='/playpause'>Play/Pause</a>
+                    <a class='button' href='/stop?{query}'>Stop Cast</a>
+                    <a class='button' href='/playpause?{query}'>Play/Pause</a>
                 </div>
                 <script>{script}</script>
 		<div style="position: fixed; bottom: 20px; right: 20px;">
@@ -440,150 +1184,178 @@ setInterval(pollStatus, 2000);
             </html>
             """.format(
                 head=self.get_head(),
+                devices=devices_html,
                 rows=rows_html,
                 toggle=toggle_label,
-                script=slider_script + keyboard_script,
+                query=device_query[1:],
+                script=f"const DEVICE = {json.dumps(device.name)};\n" + slider_script + keyboard_script,
                
             )
 
             self.wfile.write(html.encode())
 
         elif parsed.path == "/toggle_autoplay":
-            autoplay_enabled = not autoplay_enabled
+            device = self.get_device(params)
+            if not device:
+                return
+            device.autoplay = not device.autoplay
+            if not device.autoplay:
+                try:
+                    cancel_queued(device)
+                except Exception as e:
+                    print(f"Could not clear the queue on {device.name}:", e)
             self.send_response(302)
-            self.send_header("Location", "/")
+            self.send_header("Location", self.home_url(device))
             self.end_headers()
 
-        elif parsed.path == "/cast":
-                filename = params.get("file", [None])[0]
-                if filename:
-                        full_path = os.path.abspath(os.path.join(MEDIA_DIR, filename))
-                        folder = os.path.relpath(os.path.dirname(full_path), MEDIA_DIR)
-                        file = os.path.basename(full_path)
-                        try:
-                                connect_chromecast()
-
-                                # Check if something is currently playing or paused
-                                try:
-                                        media_controller.update_status()
-                                        if media_controller.status.player_state in ("PLAYING", "PAUSED", "BUFFERING"):
-                                                print("⏹ Stopping current media first...")
-                                                media_controller.stop()
-                                                # Give Chromecast a brief moment to settle before casting new file
-                                                threading.Timer(1.0, lambda: subprocess.Popen([
-                                                        CATT_PATH, "--device", CHROMECAST_NAME, "cast", full_path
-                                                ])).start()
-                                        else:
-                                                # Nothing playing, cast immediately
-                                                subprocess.Popen([
-                                                        CATT_PATH, "--device", CHROMECAST_NAME, "cast", full_path
-                                                ])
-                                except Exception as stop_err:
-                                        print("⚠️ Could not update status or stop media:", stop_err)
-                                        # Still attempt to cast anyway
-                                        subprocess.Popen([
-                                                CATT_PATH, "--device", CHROMECAST_NAME, "cast", full_path
-                                        ])
-
-                                last_cast["folder"] = folder
-                                last_cast["file"] = file
-                                schedule_next_episode(folder, file)
-
-                                self.send_response(200)
-                                self.send_header("Content-type", "text/html")
-                                self.end_headers()
-                                self.send_pretty_page("Casting", f"Now casting: {file}")
-
-                        except Exception as e:
-                                self.send_error(500, f"Casting error: {str(e)}")
-                else:
-                        self.send_error(400, "Missing file parameter")
-
         elif parsed.path == "/cast":
             filename = params.get("file", [None])[0]
+            device = self.get_device(params)
+            if not device:
+                return
             if filename:
                 full_path = os.path.abspath(os.path.join(MEDIA_DIR, filename))
                 folder = os.path.relpath(os.path.dirname(full_path), MEDIA_DIR)
                 file = os.path.basename(full_path)
+                rel_path = os.path.normpath(os.path.join(folder, file))
+                resume = hls_core.resume_position(rel_path)
+                if "start" not in params and resume:
+                    # Offer the resume point; either choice comes back here with an explicit start
+                    query = f"/cast?file={urllib.parse.quote(rel_path)}&device={urllib.parse.quote(device.name)}"
+                    minutes, seconds = divmod(int(resume), 60)
+                    self.send_response(200)
+                    self.send_header("Content-type", "text/html")
+                    self.end_headers()
+                    self.send_pretty_page("Resume", clean_title(file), device, [
+                        (f"Resume from {minutes}:{seconds:02d}", f"{query}&start={int(resume)}"),
+                        ("Start over", f"{query}&start=0"),
+                        ("Go Back", self.home_url(device)),
+                    ])
+                    return
                 try:
-                    connect_chromecast()
-                    subprocess.Popen([CATT_PATH, "--device", CHROMECAST_NAME, "cast", full_path])
-                    last_cast["folder"] = folder
-                    last_cast["file"] = file
-                    schedule_next_episode(folder, file)
+                    start = float(params.get("start", [0])[0])
+                except ValueError:
+                    start = 0
+                try:
+                    cast_file(device, folder, file, start)
                     self.send_response(200)
                     self.send_header("Content-type", "text/html")
                     self.end_headers()
-                    self.send_pretty_page("Casting", f"Now casting: {file}")
+                    self.send_pretty_page("Casting", f"Now casting: {file} on {device.name}", device)
                 except Exception as e:
                     self.send_error(500, f"Casting error: {str(e)}")
             else:
                 self.send_error(400, "Missing file parameter")
 
-        elif parsed.path == "/playpause":
+        elif parsed.path in ("/playpause", "/stop"):
+            device = self.get_device(params)
+            if not device:
+                return
+            queue_command(device, parsed.path[1:])
+            self.send_response(302)
+            self.send_header("Location", self.home_url(device))
+            self.end_headers()
+
+        elif parsed.path == "/seek":
+            device = self.get_device(params)
+            if not device:
+                return
             try:
-                connect_chromecast()
-                media_controller.update_status()
-                if media_controller.status.player_state == "PLAYING":
-                    media_controller.pause()
-                else:
-                    media_controller.play()
-                self.send_response(302)
-                self.send_header("Location", "/")
-                self.end_headers()
-            except Exception as e:
-                self.send_error(500, f"Toggle error: {str(e)}")
+                seconds = max(0.0, float(params.get("time", [0])[0]))
+            except ValueError:
+                self.send_error(400, "Bad time parameter")
+                return
+            queue_command(device, "seek", seconds)
+            # Answered with the expected state; the seek itself lands a moment later
+            self.send_response(200)
+            self.send_header("Content-type", "application/json")
+            self.end_headers()
+            self.wfile.write(json.dumps(current_status(device)).encode())
+
+        elif parsed.path == "/events":
+            device = self.get_device(params)
+            if device:
+                self.stream_events(device)
 
-        elif parsed.path == "/stop":
+        elif parsed.path.startswith("/media/"):
+            rel_path = urllib.parse.unquote(parsed.path[len("/media/"):])
+            full_path = os.path.abspath(os.path.join(MEDIA_DIR, rel_path))
+            if not full_path.startswith(MEDIA_DIR + os.sep) or not full_path.lower().endswith(VIDEO_EXTENSIONS):
+                self.send_error(404)
+                return
+            self.send_media_file(full_path)
+
+        elif parsed.path == "/thumb":
+            filename = params.get("file", [""])[0]
+            full_path = os.path.abspath(os.path.join(MEDIA_DIR, filename))
+            if not full_path.startswith(MEDIA_DIR + os.sep) or not filename.lower().endswith(VIDEO_EXTENSIONS):
+                self.send_error(404)
+                return
             try:
-                connect_chromecast()
-                media_controller.stop()
-                self.send_response(302)
-                self.send_header("Location", "/")
-                self.end_headers()
-            except Exception as e:
-                self.send_error(500, f"Stop error: {str(e)}")
+                rel_path = os.path.relpath(full_path, MEDIA_DIR)
+                job = queue_thumbnail(rel_path)
+                if job:
+                    job.result(timeout=60)
+                with open(thumbnail_path(rel_path), "rb") as f:
+                    body = f.read()
+            except Exception:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-type", "image/jpeg")
+            self.send_header("Cache-Control", "max-age=86400")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
 
-        elif parsed.path == "/seek":
+        elif parsed.path.startswith("/hls_store/"):
+            match = re.match(r"/hls_store/(\w+)/(thumbs\d*\.(?:vtt|jpg))$", parsed.path)
+            if not match:
+                self.send_error(404)
+                return
+            path = os.path.join(HLS_STORE_DIR, *match.groups())
             try:
-                seconds = float(params.get("time", [0])[0])
-                connect_chromecast()
-                media_controller.seek(seconds)
-                self.send_response(200)
-                self.end_headers()
-            except Exception as e:
-                self.send_error(500, f"Seek error: {str(e)}")
+                with open(path, "rb") as f:
+                    body = f.read()
+            except OSError:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-type", "text/vtt" if path.endswith(".vtt") else "image/jpeg")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
 
         elif parsed.path == "/status":
-            try:
-                connect_chromecast()
-                media_controller.update_status()
-                status = {
-                    "current_time": media_controller.status.current_time or 0,
-                    "duration": media_controller.status.duration or 0,
-                    "state": media_controller.status.player_state or "UNKNOWN"
-                }
-                self.send_response(200)
-                print("📊 Status response:", json.dumps(status, indent=2))
-                self.send_header("Content-type", "application/json")
-                self.end_headers()
-                self.wfile.write(json.dumps(status).encode())
+            device = self.get_device(params)
+            if not device:
+                return
+            status = current_status(device)
+            self.send_response(200)  # Still 200 OK when offline
+            self.send_header("Content-type", "application/json")
+            self.end_headers()
+            self.wfile.write(json.dumps(status).encode())
 
-            except Exception as e:
-                print("Status polling failed:", e)
-                self.send_response(200)  # Still respond with 200 OK
-                self.send_header("Content-type", "application/json")
-                self.end_headers()
-                self.wfile.write(json.dumps({
-                    "current_time": 0,
-                    "duration": 0,
-                    "state": "OFFLINE"
-                }).encode())
+        elif parsed.path == "/devices":
+            devices = {name: current_status(device) for name, device in sorted(cast_devices.items())}
+            self.send_response(200)
+            self.send_header("Content-type", "application/json")
+            self.end_headers()
+            self.wfile.write(json.dumps(devices).encode())
 
 
 if __name__ == "__main__":
     load_metadata()
+    hls_core.sync_positions()  # nothing to write yet, just picks up what is on disk
+    queue_missing_thumbnails()
+    add_device(CHROMECAST_NAME, CHROMECAST_IP)
+    for name in load_cast_cache():
+        add_device(name)
+    threading.Thread(target=device_discovery, daemon=True).start()
+    threading.Thread(target=status_producer, daemon=True).start()
+    threading.Thread(target=autoplay_manager, daemon=True).start()
+    threading.Thread(target=position_writer, daemon=True).start()
     os.chdir(APP_ROOT)
     server_address = (PI_IP, PORT)
     print(f"🎬 Serving on http://{PI_IP}:{PORT}/")
-    HTTPServer(server_address, BannerHandler).serve_forever()
+    ThreadingHTTPServer(server_address, BannerHandler).serve_forever()